@@ -1,17 +1,71 @@
 import sys
 import time
+from multiprocessing import Process
 
 import schedule
 
-from src.news_articles_nlp_pipeline.pipeline import news_articles_nlp_pipeline
-from src.commons import set_env_to_dev, set_env_to_prod
+from src.news_articles_nlp_pipeline.pipeline import (
+    news_articles_nlp_pipeline,
+    news_articles_nlp_streaming_pipeline,
+    news_articles_nlp_backfill_pipeline
+)
+from src.news_articles_nlp_pipeline.workers import poll_feeds
+from src.commons import set_env_to_dev, set_env_to_prod, set_cassette_mode, set_memory_budget
+from src.env import is_env_prod
+
+
+def configure(args: list[str]):
+    set_env_to_prod() if '--prod' in args else set_env_to_dev()
+
+    for mode in ['record', 'replay', 'replay-with-latency']:
+        if f'--{mode}' in args:
+            set_cassette_mode(mode)
+
+    for arg in args:
+        if arg.startswith('--memory-budget='):
+            set_memory_budget(int(arg.removeprefix('--memory-budget=')))
 
-if __name__ == '__main__':
-    set_env_to_prod() if '--prod' in sys.argv[1:] else set_env_to_dev()
 
-    news_articles_nlp_pipeline()
-    schedule.every(30).minutes.do(news_articles_nlp_pipeline)
+def run(args: list[str]):
+    configure(args)
+
+    # Backfills run once, on the articles indexed so far
+    if '--backfill' in args:
+        news_articles_nlp_backfill_pipeline()
+        return
+
+    pipeline = news_articles_nlp_streaming_pipeline if '--stream' in args else news_articles_nlp_pipeline
+
+    pipeline(index_articles=False)
+    schedule.every(30).minutes.do(pipeline, index_articles=False)
 
     while True:
         schedule.run_pending()
         time.sleep(60)
+
+
+def poll(args: list[str]):
+    configure(args)
+
+    # In prod, feeds are polled (and their new articles scraped) on their own adaptive intervals
+    if not is_env_prod():
+        return
+
+    while True:
+        poll_feeds()
+        time.sleep(60)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    processes_count = int(next(iter([a.removeprefix('--processes=') for a in args if a.startswith('--processes=')]), 1))
+
+    # Feeds are polled on their own process, so they are polled on time even while a pipeline runs for hours
+    if '--backfill' not in args:
+        Process(target=poll, args=(args,), name='ml-studies-poller', daemon=True).start()
+
+    # Processes share the work through leases on index entries (See: src.leases)
+    for i in range(processes_count - 1):
+        Process(target=run, args=(args,), name=f'ml-studies-p{i + 1}', daemon=True).start()
+
+    run(args)
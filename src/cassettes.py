@@ -0,0 +1,90 @@
+import base64
+import gzip
+import json
+import time
+from threading import Lock
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from src.commons import file_lock, makedirs_from_path
+from src.enums import Paths
+from src.env import is_cassette_recording, is_cassette_replaying, cassette_mode
+
+# Seconds to wait for a server to connect and respond, unless given otherwise
+DEFAULT_TIMEOUT = 30
+
+_lock = Lock()
+_recordings = None
+_replay_positions = {}
+
+
+def _record(url: str, response: requests.Response):
+    # Recordings are keyed by the url that was requested, since responses that were redirected have another url
+    recording = dict(
+        url=response.url,
+        requested_url=url,
+        status_code=response.status_code,
+        headers=dict(response.headers),
+        content=base64.b64encode(response.content).decode('ascii'),
+        elapsed=response.elapsed.total_seconds()
+    )
+    path = Paths.CASSETTE.format()
+    makedirs_from_path(path)
+
+    # Every recording is its own gzip member, so recordings can be appended without rewriting the cassette
+    with _lock, file_lock(path), gzip.open(path, 'at', encoding='utf-8') as f:
+        f.write(json.dumps(recording) + '\n')
+
+
+def _load_recordings():
+    global _recordings
+
+    if _recordings is None:
+        _recordings = {}
+        with gzip.open(Paths.CASSETTE.format(), 'rt', encoding='utf-8') as f:
+            for line in f:
+                recording = json.loads(line)
+                _recordings.setdefault(recording['requested_url'], []).append(recording)
+    return _recordings
+
+
+def _replay(url: str) -> requests.Response:
+    with _lock:
+        recordings = _load_recordings().get(url)
+        if not recordings:
+            raise requests.exceptions.ConnectionError(f'No recorded response for: {url}')
+
+        # Urls requested several times (ex: feeds) replay their recordings in order, then repeat the last one
+        position = _replay_positions.get(url, 0)
+        _replay_positions[url] = position + 1
+        recording = recordings[min(position, len(recordings) - 1)]
+
+    if cassette_mode() == 'replay-with-latency':
+        time.sleep(recording['elapsed'])
+
+    response = requests.Response()
+    response.url = recording['url']
+    response.status_code = recording['status_code']
+    response.headers = CaseInsensitiveDict(recording['headers'])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = base64.b64decode(recording['content'])
+    return response
+
+
+def fetch(url: str, timeout: float | tuple[float, float] = DEFAULT_TIMEOUT) -> requests.Response:
+    """
+    GET request, which goes through the cassette (`data/{env}/news-articles-nlp/cassette.jsonl.gz`) depending on its
+    mode (ML_STUDIES_CASSETTE env variable):
+    - record: responses are fetched, and recorded (with their headers and latencies).
+    - replay: responses are served from the recordings, without any network access.
+    - replay-with-latency: same as replay, after waiting for the recorded latency.
+    :param timeout: Seconds to wait for the server to connect and respond (See: requests' timeouts).
+    """
+    if is_cassette_replaying():
+        return _replay(url)
+
+    response = requests.get(url, timeout=timeout)
+    if is_cassette_recording():
+        _record(url, response)
+    return response
@@ -1,10 +1,16 @@
+import fcntl
+import hashlib
+import io
 import json
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from os.path import exists
+from os.path import exists, dirname, abspath
 from os import environ, makedirs
-from threading import current_thread
-from typing import Optional, Callable, Any
+from threading import current_thread, get_ident, Lock
+from typing import Optional, Callable, Any, Iterable
 import numpy as np
 
 import spacy
@@ -14,8 +20,22 @@ from .enums import Paths
 
 nlp = spacy.load('en_core_web_sm')
 
+# Count of threads reading prefetched files
+PREFETCH_THREADS = 8
 
-def read(path, mode='r', encoding='utf-8'):
+# Directories known to exist, so writes don't have to check for them every time
+_known_dirs = set()
+
+# Paths overwritten since the last `sync_writes`
+_unsynced_paths = set()
+_unsynced_lock = Lock()
+
+_prefetch_executor = None
+_prefetch_lock = Lock()
+_prefetched = {}
+
+
+def _read(path, mode='r', encoding='utf-8'):
     if exists(path):
 
         kwargs = dict(
@@ -31,16 +51,87 @@ def read(path, mode='r', encoding='utf-8'):
             return f.read()
 
 
+def read(path, mode='r', encoding='utf-8'):
+    # Files prefetched are only read once from the disk
+    future = _prefetched.pop((path, mode), None)
+    if future:
+        return future.result()
+    return _read(path, mode, encoding)
+
+
+def prefetch(paths: Iterable[str], mode='r', encoding='utf-8'):
+    """
+    Starts reading files in the background, so the next `read` of each of them doesn't wait on the disk.
+    :param paths: The paths of the files to prefetch. Files that don't exist are read as None.
+    """
+    global _prefetch_executor
+
+    with _prefetch_lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(PREFETCH_THREADS, thread_name_prefix='ml-studies-prefetch')
+
+    for path in paths:
+        if (path, mode) not in _prefetched:
+            _prefetched[(path, mode)] = _prefetch_executor.submit(_read, path, mode, encoding)
+
+
+def discard_prefetched():
+    """
+    Discards the prefetched files that were never read.
+    """
+    _prefetched.clear()
+
+
+def read_many(paths: list[str], mode='r', encoding='utf-8') -> list:
+    """
+    Reads files concurrently.
+    :return: The contents of each file (None if it doesn't exist), in the order of the paths.
+    """
+    prefetch(paths, mode, encoding)
+    return [read(path, mode, encoding) for path in paths]
+
+
+def lemmatize(tokens) -> list[str]:
+    """
+    Lemmatizes the tokens of a spacy span or doc, leaving out stop words, punctuation, urls, emails, handles and spaces.
+    """
+    return [
+        token.lemma_.lower() for token in tokens if
+        not token.is_stop and
+        not token.is_punct and
+        not token.like_url and
+        not token.like_email and
+        not token.text.startswith('@') and
+        not token.is_space
+    ]
+
+
 def makedirs_from_path(path: str):
-    if not exists(path):
-        dir_path = '/'.join(path.split('/')[:-1])
-        if not exists(dir_path):
-            makedirs(dir_path)
+    # Known directories are absolute, since relative ones change with the working directory
+    dir_path = dirname(abspath(path))
+    if dir_path not in _known_dirs:
+        makedirs(dir_path, exist_ok=True)
+        _known_dirs.add(dir_path)
 
 
-def write(path, contents, mode='w', encoding='utf-8'):
-    makedirs_from_path(path)
+@contextmanager
+def file_lock(path: str):
+    """
+    Exclusive lock (shared between processes) on a sibling lock file of the given path.
+    :param path: The path of the file to lock.
+    """
+    lock_path = path + '.lock'
+    makedirs_from_path(lock_path)
+
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
 
+def _write(path, contents, mode='w', encoding='utf-8', sync=False):
     kwargs = dict(
         file=path,
         mode=mode,
@@ -52,6 +143,105 @@ def write(path, contents, mode='w', encoding='utf-8'):
 
     with open(**kwargs) as f:
         f.write(contents)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write(path, contents, mode='w', encoding='utf-8', sync=False):
+    """
+    Overwrites ('w', 'wb') are atomic: contents are written to a temporary file, which then replaces the file, so
+    readers never see a truncated file. Appends ('a', 'ab') are written in place.
+    :param sync: If true, the file is fsynced before being replaced. Otherwise, it is fsynced on `sync_writes`.
+    """
+    makedirs_from_path(path)
+    _prefetched.pop((path, 'r'), None)
+    _prefetched.pop((path, 'rb'), None)
+
+    if not mode.startswith('w'):
+        _write(path, contents, mode, encoding)
+        return
+
+    tmp_path = f'{path}.{os.getpid()}-{get_ident()}.tmp'
+    try:
+        _write(tmp_path, contents, mode, encoding, sync)
+    except FileNotFoundError:
+        # The directory was removed since it was created
+        _known_dirs.discard(dirname(abspath(path)))
+        makedirs_from_path(path)
+        _write(tmp_path, contents, mode, encoding, sync)
+    os.replace(tmp_path, path)
+
+    if not sync:
+        with _unsynced_lock:
+            _unsynced_paths.add(path)
+
+
+def write_with(path, save: Callable[[Any], Any], sync=False):
+    """
+    Atomically writes a file with a fn that saves to file objects (ex: np.save, np.savez, scipy.sparse.save_npz).
+    :param save: Saves the contents to the (binary) file object it's given.
+    :param sync: See `write`.
+    """
+    buffer = io.BytesIO()
+    save(buffer)
+    write(path, buffer.getvalue(), mode='wb', sync=sync)
+
+
+def sync_writes():
+    """
+    Fsyncs the files overwritten since the last sync, and their directories (so their renames are durable as well).
+    Batching fsyncs this way is much cheaper than fsyncing every file as it's written.
+    :return: The count of files synced.
+    """
+    with _unsynced_lock:
+        paths = list(_unsynced_paths)
+        _unsynced_paths.clear()
+
+    for path in paths + list({dirname(p) for p in paths if dirname(p)}):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    return len(paths)
+
+
+def append_string(path: str, value: str) -> list[int]:
+    """
+    Appends a string to a string table file.
+    :return: The reference of the string in the table: [offset, length] (in bytes)
+    """
+    encoded = value.encode('utf-8')
+    makedirs_from_path(path)
+
+    with file_lock(path), open(path, 'ab') as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(encoded)
+
+    return [offset, len(encoded)]
+
+
+def read_string(path: str, ref: list[int]) -> str:
+    """
+    Reads a string from a string table file.
+    :param ref: The reference of the string in the table: [offset, length] (in bytes)
+    """
+    offset, length = ref
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length).decode('utf-8')
+
+
+def get_stable_hash(value: str) -> str:
+    """
+    64 bit hash of a string, which (unlike `hash`) is the same across processes.
+    """
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
 
 
 def try_load_json(o):
@@ -105,6 +295,16 @@ def set_env_to_dev():
     info('Working environment set to dev.')
 
 
+def set_cassette_mode(value: str):
+    environ['ML_STUDIES_CASSETTE'] = value
+    info(f'Cassette mode set to {value}.')
+
+
+def set_memory_budget(megabytes: int):
+    environ['ML_STUDIES_MEMORY_BUDGET_MB'] = str(megabytes)
+    info(f'Memory budget set to {megabytes} MB.')
+
+
 def set_current_pipeline_var(value: str):
     key = 'CURRENT_PIPELINE'
     info(f'Setting {key} env variable to: {value}')
@@ -117,6 +317,60 @@ def set_current_worker_var(value: str):
     environ[key] = value
 
 
+def to_datetime(value) -> Optional[datetime]:
+    """
+    Datetimes of models are isoformat strings once loaded from an index.
+    """
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def get_freshness_priority(
+        published: Optional[datetime],
+        topic_weight: float,
+        stages_left: int,
+        seconds_per_stage_left: float,
+        default_age: float = 7 * 24 * 60 * 60
+):
+    """
+    Priority of an article in the queue of a stage (the lower, the sooner). Fresh articles of heavy topics come first.
+    Articles with fewer stages left come before otherwise equal ones, so started articles get finished.
+    :param published: When the article was published. If none, the article is treated as `default_age` seconds old.
+    :param topic_weight: Weight of the topic of the article. Ages are divided by it.
+    :param stages_left: Count of stages left for the article, including the current one.
+    :param seconds_per_stage_left: Seconds of age each stage left is worth.
+    :param default_age: Age in seconds of articles without a publish time.
+    """
+    age = (now() - published).total_seconds() if published else default_age
+    return age / topic_weight + stages_left * seconds_per_stage_left
+
+
+def get_next_poll_interval(
+        publish_rate: Optional[float],
+        min_interval: float,
+        max_interval: float,
+        default_interval: float,
+        jitter: float = .1
+):
+    """
+    Finds how long to wait before polling a feed again, so that each poll finds about one new article.
+    :param publish_rate: Observed new articles per second of the feed. If none, the default interval is used.
+    :param min_interval: The minimum interval in seconds.
+    :param max_interval: The maximum interval in seconds.
+    :param default_interval: The interval in seconds used if the publish rate is unknown.
+    :param jitter: Ratio of the interval to randomly add or remove, so feeds don't end up being polled all at once.
+    :return: The interval in seconds
+    """
+    if publish_rate is None:
+        interval = default_interval
+    elif publish_rate == 0:
+        interval = max_interval
+    else:
+        interval = 1 / publish_rate
+
+    interval *= random.uniform(1 - jitter, 1 + jitter)
+    return min(max(interval, min_interval), max_interval)
+
+
 def get_sentence_similarity_score(sent1: list[str], sent2: list[str]):
     def custom_equal_fn(token1, token2):
         _d = get_levenshtein_distance(token1, token2)
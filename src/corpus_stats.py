@@ -0,0 +1,247 @@
+import json
+from os.path import exists, getmtime
+from threading import Lock
+
+import numpy as np
+from scipy import sparse
+
+from src.commons import read, write, write_with, try_load_json, file_lock
+from src.enums import Paths
+from src.models import ArticleIndexEntry
+
+_lock = Lock()
+_delta = None
+_counted_documents = None
+_stats_cache = {}
+
+
+def _path(filename: str):
+    return Paths.CORPUS_STATS.format(filename=filename)
+
+
+def _empty_stats():
+    """
+    Corpus statistics. Lemmas and topics are mapped to positions in the arrays by the `vocabulary` and `topics` lists.
+    Arrays may have more capacity than there are lemmas or topics, so they can grow without being copied every time.
+    Most lemmas only occur in a few topics, so the token counts per topic are a sparse (topics, lemmas) matrix.
+    """
+    return dict(
+        vocabulary=[],
+        vocabulary_ids={},
+        topics=[],
+        topic_ids={},
+        documents=[],
+        document_frequencies=np.zeros(0, dtype=np.int64),
+        token_counts=np.zeros(0, dtype=np.int64),
+        topic_document_counts=np.zeros(0, dtype=np.int64),
+        topic_token_counts=sparse.csr_matrix((0, 0), dtype=np.int64),
+    )
+
+
+def _grow(capacity: int, count: int):
+    capacity = max(capacity, 1)
+    while capacity < count:
+        capacity *= 2
+    return capacity
+
+
+def _ensure_capacity(stats: dict):
+    lemmas_count, topics_count = len(stats['vocabulary']), len(stats['topics'])
+    lemmas_capacity, topics_capacity = len(stats['document_frequencies']), len(stats['topic_document_counts'])
+
+    if lemmas_count > lemmas_capacity:
+        lemmas_capacity = _grow(lemmas_capacity, lemmas_count)
+        for key in ['document_frequencies', 'token_counts']:
+            stats[key] = np.concatenate([stats[key], np.zeros(lemmas_capacity - len(stats[key]), dtype=np.int64)])
+
+    if topics_count > topics_capacity:
+        topics_capacity = _grow(topics_capacity, topics_count)
+        stats['topic_document_counts'] = np.concatenate([
+            stats['topic_document_counts'],
+            np.zeros(topics_capacity - len(stats['topic_document_counts']), dtype=np.int64)
+        ])
+
+
+def _add_topic_token_counts(stats: dict, rows: np.ndarray, columns: np.ndarray, values: np.ndarray):
+    shape = len(stats['topics']), len(stats['vocabulary'])
+    counts = stats['topic_token_counts']
+    counts.resize(shape)
+
+    # Duplicates are summed. Counts taken back (See: add_to_corpus_stats) may leave zeros, which aren't stored
+    counts = counts + sparse.csr_matrix((values, (rows, columns)), shape=shape, dtype=np.int64)
+    counts.eliminate_zeros()
+    stats['topic_token_counts'] = counts
+
+
+def _get_topic_token_counts(stats: dict) -> sparse.csr_matrix:
+    """
+    :return: The token counts per topic, including the ones counted since they were last summed (See: _count).
+    """
+    pending = stats.get('pending_topic_token_counts')
+    if pending:
+        _add_topic_token_counts(stats, *(np.concatenate(arrays) for arrays in zip(*pending)))
+        pending.clear()
+    return stats['topic_token_counts']
+
+
+def _get_ids(values: list[str], values_list: list[str], ids: dict[str, int]):
+    for value in values:
+        if value not in ids:
+            ids[value] = len(values_list)
+            values_list.append(value)
+    return np.array([ids[v] for v in values], dtype=np.int64)
+
+
+def merge_corpus_stats(stats: dict, other: dict):
+    """
+    Adds the counts of other corpus statistics to these ones.
+    :param stats: The statistics to merge into.
+    :param other: The statistics to merge.
+    """
+    lemmas_count, topics_count = len(other['vocabulary']), len(other['topics'])
+    other_topic_token_counts = _get_topic_token_counts(other).tocoo()
+    lemma_ids = _get_ids(other['vocabulary'], stats['vocabulary'], stats['vocabulary_ids'])
+    topic_ids = _get_ids(other['topics'], stats['topics'], stats['topic_ids'])
+    _ensure_capacity(stats)
+
+    stats['documents'].extend(other['documents'])
+    stats['document_frequencies'][lemma_ids] += other['document_frequencies'][:lemmas_count]
+    stats['token_counts'][lemma_ids] += other['token_counts'][:lemmas_count]
+    stats['topic_document_counts'][topic_ids] += other['topic_document_counts'][:topics_count]
+
+    # The counts of the other statistics, on the positions of the lemmas and topics of these ones
+    _add_topic_token_counts(
+        stats,
+        topic_ids[other_topic_token_counts.row],
+        lemma_ids[other_topic_token_counts.col],
+        other_topic_token_counts.data
+    )
+    return stats
+
+
+def load_corpus_stats():
+    stats = _empty_stats()
+    if not exists(_path('counts.npz')):
+        return stats
+
+    metadata = try_load_json(read(_path('metadata.json')))
+    with np.load(_path('counts.npz')) as counts:
+        stats.update(
+            vocabulary=metadata['vocabulary'],
+            vocabulary_ids={lemma: i for i, lemma in enumerate(metadata['vocabulary'])},
+            topics=metadata['topics'],
+            topic_ids={topic: i for i, topic in enumerate(metadata['topics'])},
+            documents=metadata['documents'],
+            topic_token_counts=sparse.load_npz(_path('topic-token-counts.npz')).tocsr(),
+            **{key: counts[key] for key in counts.files}
+        )
+    return stats
+
+
+def _save_corpus_stats(stats: dict):
+    lemmas_count, topics_count = len(stats['vocabulary']), len(stats['topics'])
+
+    topic_token_counts = _get_topic_token_counts(stats)
+
+    write_with(_path('topic-token-counts.npz'), lambda f: sparse.save_npz(f, topic_token_counts))
+    write_with(_path('counts.npz'), lambda f: np.savez(
+        f,
+        document_frequencies=stats['document_frequencies'][:lemmas_count],
+        token_counts=stats['token_counts'][:lemmas_count],
+        topic_document_counts=stats['topic_document_counts'][:topics_count],
+    ))
+    write(_path('metadata.json'), json.dumps({k: stats[k] for k in ['vocabulary', 'topics', 'documents']}))
+
+
+def _count(stats: dict, topic: str, occurrences: dict[str, int], sign: int = 1):
+    lemma_ids = _get_ids(list(occurrences), stats['vocabulary'], stats['vocabulary_ids'])
+    topic_id = _get_ids([topic], stats['topics'], stats['topic_ids'])[0]
+    counts = sign * np.fromiter(occurrences.values(), dtype=np.int64, count=len(occurrences))
+    _ensure_capacity(stats)
+
+    stats['document_frequencies'][lemma_ids] += sign
+    stats['token_counts'][lemma_ids] += counts
+    stats['topic_document_counts'][topic_id] += sign
+
+    # Summed into the sparse matrix on merges, rather than on every article (See: _get_topic_token_counts)
+    stats['pending_topic_token_counts'].append((np.full(len(lemma_ids), topic_id), lemma_ids, counts))
+
+
+def add_to_corpus_stats(entry: ArticleIndexEntry, occurrences: dict[str, int], prev_occurrences: dict[str, int] = None):
+    """
+    Counts an analyzed article in this process's corpus statistics, in O(lemmas of the article). Counts are added to
+    the stored statistics on `flush_corpus_stats`.
+    :param entry: The entry of the analyzed article.
+    :param occurrences: Occurrences of each lemma in the article.
+    :param prev_occurrences: Occurrences of each lemma in the previous analysis of the article, if it was analyzed
+    before (e.g. backfills). Articles already counted are only counted again if given, in place of these.
+    """
+    global _delta, _counted_documents
+
+    with _lock:
+        if _counted_documents is None:
+            _counted_documents = set(load_corpus_stats()['documents'])
+        if _delta is None:
+            _delta = dict(_empty_stats(), recounted=[], pending_topic_token_counts=[])
+
+        if entry.filename in _counted_documents:
+            if prev_occurrences is None:
+                return
+            # Counts are merged by addition, so the previous counts are taken back with negative ones
+            _count(_delta, entry.topic, prev_occurrences, sign=-1)
+            _delta['recounted'].append(entry.filename)
+        else:
+            _counted_documents.add(entry.filename)
+            _delta['documents'].append(entry.filename)
+
+        _count(_delta, entry.topic, occurrences)
+
+
+def flush_corpus_stats():
+    """
+    Merges this process's counts into the stored corpus statistics, which may also hold counts of other processes.
+    :return: The count of articles merged (counted or counted again).
+    """
+    global _delta, _counted_documents
+
+    with _lock:
+        if not _delta or not _delta['documents'] and not _delta['recounted']:
+            return 0
+
+        # Articles are leased while analyzed (See: src.leases), so processes never count the same article twice
+        with file_lock(_path('counts.npz')):
+            stats = merge_corpus_stats(load_corpus_stats(), _delta)
+            _save_corpus_stats(stats)
+
+        documents_count = len(_delta['documents']) + len(_delta['recounted'])
+        _counted_documents = set(stats['documents'])
+        _delta = None
+
+    return documents_count
+
+
+def get_corpus_stats():
+    """
+    The stored corpus statistics. Only reloaded when they have been flushed since they were last loaded.
+    """
+    path = _path('metadata.json')
+    mtime = getmtime(path) if exists(path) else None
+    cached = _stats_cache.get(path)
+
+    if not cached or cached[0] != mtime:
+        cached = mtime, load_corpus_stats()
+        _stats_cache[path] = cached
+
+    return cached[1]
+
+
+def get_idf_vector(stats: dict = None):
+    """
+    Smoothed inverse document frequencies of the lemmas of the corpus: ln((1 + N) / (1 + df)) + 1
+    :param stats: The corpus statistics. Defaults to the stored ones.
+    :return: The vocabulary and the inverse document frequency of each of its lemmas.
+    """
+    stats = stats or get_corpus_stats()
+    document_frequencies = stats['document_frequencies'][:len(stats['vocabulary'])]
+    idf = np.log((1 + len(stats['documents'])) / (1 + document_frequencies)) + 1
+    return stats['vocabulary'], idf
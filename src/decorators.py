@@ -2,9 +2,19 @@ import time
 from threading import Thread, enumerate as enum_threads, current_thread
 from typing import Callable
 
-from src.commons import now, info, error, success
-from src.enums import ReportTypes
+from src.commons import now, info, error, success, to_datetime, sync_writes, discard_prefetched
+from src.enums import ReportTypes, Paths, Status
 from src.env import is_env_dev
+from src.index_manager import record_mutation
+from src.leases import acquire_lease, release_lease, record_completion, get_completion, LeaseNotAcquired
+from src.memory import (
+    admission,
+    estimate_task_cost,
+    record_rss,
+    reset_peak_rss,
+    get_peak_rss,
+    pop_peak_rss_by_stage
+)
 from src.models import ArticleIndexEntry, Report
 
 
@@ -50,8 +60,29 @@ def pipeline(func):
     return ml_studies_fn(func, 'pipeline')
 
 
+def _log_peak_rss(worker_name: str):
+    peak_rss, peaks_by_stage = get_peak_rss(), pop_peak_rss_by_stage()
+    if peak_rss is None:
+        return
+
+    message = f'Peak RSS of worker {worker_name}: {peak_rss / 1024 / 1024:.0f} MB'
+    if peaks_by_stage:
+        message += '. By stage: ' + ', '.join(f'{k}: {v / 1024 / 1024:.0f} MB' for k, v in peaks_by_stage.items())
+    info(message)
+
+
 def worker(func):
-    return ml_studies_fn(func, 'worker')
+    def inner(*args, **kwargs):
+        reset_peak_rss()
+        result = ml_studies_fn(func, 'worker')(*args, **kwargs)
+
+        # Artifacts written by the worker are made durable in one batch, once it's done (See: src.commons.write)
+        sync_writes()
+        discard_prefetched()
+
+        _log_peak_rss(func.__name__)
+        return result
+    return inner
 
 
 def task(**kwargs):
@@ -66,14 +97,83 @@ def subtask(**kwargs):
     return outer
 
 
+def _find_entry(args, kwargs) -> ArticleIndexEntry:
+    return kwargs.get('entry') or next(iter([a for a in args if isinstance(a, ArticleIndexEntry)]), None)
+
+
+def admitted(name: ReportTypes, input_path: Paths = None):
+    """
+    Only runs the fn once the process has enough memory left for it (See: src.memory.admission). Its cost is estimated
+    from the size of its input file. Must be placed below `threaded`, so the fns streams run are admitted as well.
+    :param name: The report type of the fn.
+    :param input_path: The path of the file the fn reads, formatted with the entry.
+    """
+    def outer(func):
+        def inner(*args, **kwargs):
+            entry = _find_entry(args, kwargs)
+            path = input_path.format(**dict(entry)) if input_path and entry else None
+
+            with admission(estimate_task_cost(name, path)):
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record_rss(name.value)
+        return inner
+    return outer
+
+
+def leased(name: ReportTypes):
+    """
+    Only runs the fn if this process can claim the entry for the report type, so concurrent processes running the same
+    worker don't do the same work twice. Entries completed by another process since this process's copy of the index
+    was loaded are skipped as well. Must be placed above `log_report` so skipped entries keep their report.
+    """
+    def outer(func):
+        def inner(*args, **kwargs):
+            entry = _find_entry(args, kwargs)
+            key = f'{name.value}:{entry.url}'
+
+            if not acquire_lease(key):
+                info(f'Skipping {key}: claimed by another process.')
+                return None, LeaseNotAcquired(key)
+
+            try:
+                report = entry.reports.get(name.value)
+                completed_at = get_completion(key)
+                if completed_at and completed_at > (report.get_end_isoformat() if report else ''):
+                    info(f'Skipping {key}: completed by another process at {completed_at}.')
+                    return None, LeaseNotAcquired(key)
+
+                result = func(*args, **kwargs)
+                report = entry.reports[name.value]
+                if report.status == Status.SUCCESS:
+                    record_completion(key, report.get_end_isoformat())
+                return result
+            finally:
+                release_lease(key)
+        return inner
+    return outer
+
+
 def log_report(name: ReportTypes):
     def outer(func):
         def inner(*args, **kwargs):
-            report = Report.open()
-            entry = kwargs.get('entry') or next(iter([a for a in args if isinstance(a, ArticleIndexEntry)]), None)
+            entry = _find_entry(args, kwargs)
+            prev_report = entry.reports.get(name.value)
+            report = Report.open(
+                prev_report if prev_report and prev_report.has_been_attempted else None,
+                version=name.version
+            )
             result, exception, (start, end, elapsed) = func(*args, **kwargs)
             report.close(result, exception, start=start, end=end, elapsed=elapsed)
+
+            # Recorded as the report is closed, so it is part of the report's first write (See: ArticleIndex.merge)
+            published = to_datetime(entry.published or entry.indexed_at)
+            if published:
+                report.additional_data['seconds_from_published'] = (end - published).total_seconds()
+
             entry.reports[name.value] = report
+            record_mutation('articles', entry.url, entry)
             return result, exception
         return inner
     return outer
@@ -140,5 +240,7 @@ def threaded(max_threads: int = None):
             _threads[k].append(thread)
             thread.start()
 
+        # Exposes the un-threaded fn for callers that manage their own threads (See: src.streams)
+        inner.__wrapped__ = func
         return inner
     return outer
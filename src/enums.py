@@ -20,13 +20,34 @@ class ReportTypes(BaseEnum):
     CREATE_SENTIMENT_ANALYSIS = 'create_sentiment_analysis'
     CREATE_SUMMARY = 'create_summary'
 
+    @property
+    def version(self) -> int:
+        return REPORT_TYPES_VERSIONS[self]
+
+
+# Bump the version of a report type when the artifacts of its stage change, so they get backfilled (See: --backfill)
+REPORT_TYPES_VERSIONS = {
+    ReportTypes.SCRAPE_ARTICLE: 1,
+    ReportTypes.EXTRACT_TEXT: 1,
+    ReportTypes.ANALYZE_TEXT: 1,
+    ReportTypes.CREATE_SENTIMENT_ANALYSIS: 1,
+    ReportTypes.CREATE_SUMMARY: 1,
+}
+
 
 class Paths(BaseEnum):
     LOGGING = 'data/{env}/news-articles-nlp/logs.log'
     ARTICLES_INDEX = 'data/{env}/news-articles-nlp/index.json'
     SENTENCES_INDEX = 'data/{env}/news-articles-nlp/sentence-index.json'
-
-    SCRAPE_HTMLS_OUTPUT = 'data/{env}/news-articles-nlp/articles//{source}/html/{filename}.html'
+    SENTENCES_STRINGS = 'data/{env}/news-articles-nlp/sentence-strings.txt'
+    FEEDS_INDEX = 'data/{env}/news-articles-nlp/feed-index.json'
+    LEMMA_INDEX = 'data/{env}/news-articles-nlp/lemma-index/{filename}'
+    CORPUS_STATS = 'data/{env}/news-articles-nlp/corpus-stats/{filename}'
+    STORY_CLUSTERS = 'data/{env}/news-articles-nlp/story-clusters/{filename}'
+    CASSETTE = 'data/{env}/news-articles-nlp/cassette.jsonl.gz'
+    LEASES_DB = 'data/{env}/news-articles-nlp/leases.sqlite3'
+
+    SCRAPE_HTMLS_OUTPUT = 'data/{env}/news-articles-nlp/articles/{source}/html/{filename}.html'
     EXTRACT_TEXTS_OUTPUT = 'data/{env}/news-articles-nlp/articles/{source}/extracted/{filename}.txt'
     ANALYZE_TEXTS_OUTPUT = 'data/{env}/news-articles-nlp/articles/{source}/analyzed/{filename}.json'
     SENTIMENT_ANALYSES_OUTPUT = 'data/{env}/news-articles-nlp/articles/{source}/sentiment-analyses/{filename}.json'
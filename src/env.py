@@ -11,3 +11,23 @@ def is_env_prod():
 
 def is_env_dev():
     return working_env() == 'dev'
+
+
+def cassette_mode(default: str = None):
+    return environ.get('ML_STUDIES_CASSETTE', default)
+
+
+def is_cassette_recording():
+    return cassette_mode() == 'record'
+
+
+def is_cassette_replaying():
+    return cassette_mode() in ('replay', 'replay-with-latency')
+
+
+def memory_budget() -> int | None:
+    """
+    The RSS (in bytes) tasks are admitted under (See: src.memory). None if there is no budget.
+    """
+    megabytes = environ.get('ML_STUDIES_MEMORY_BUDGET_MB')
+    return int(megabytes) * 1024 * 1024 if megabytes else None
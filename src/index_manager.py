@@ -1,24 +1,170 @@
 import json
+import os
+import time
 from contextlib import contextmanager
-from threading import Lock
+from threading import RLock, Lock, Thread, Event
 
-from src.commons import error, write
+from src.commons import error, read, write, try_load_json, file_lock, sync_writes
 from src.enums import Paths
-from src.models import ArticleIndex, SentenceIndex
+from src.models import ArticleIndex, SentenceIndex, FeedIndex, Model
 
 
 index_map = {
     'sentences': (SentenceIndex, Paths.SENTENCES_INDEX),
-    'articles': (ArticleIndex, Paths.ARTICLES_INDEX)
+    'articles': (ArticleIndex, Paths.ARTICLES_INDEX),
+    'feeds': (FeedIndex, Paths.FEEDS_INDEX)
 }
 
+# Journaled mutations are written (and fsynced) once there are this many of them, or once the oldest is this old
+JOURNAL_BATCH_SIZE = 20
+JOURNAL_BATCH_INTERVAL = 1
+
+_locks = {name: RLock() for name in index_map}
+_journals = {}
+
+
+def _merge_journal(index_cls, path: str, index):
+    journal_index = index_cls(None)
+    for line in (read(path + '.journal') or '').splitlines():
+        mutation = try_load_json(line)
+        if mutation:
+            journal_index.load_model(mutation['key'], mutation['value'])
+    return index.merge(journal_index)
+
+
+def _get_signature(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # Indexes are replaced (See: src.commons.write) rather than written in place, so each version has its own inode
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _write_index(index_cls, path: str, index=None, loaded_signature=None):
+    """
+    :param index: The in-memory index to merge into the index on disk, if any.
+    :param loaded_signature: The signature (See: _get_signature) of the file the in-memory index was loaded from.
+    """
+    # Artifacts must be durable before the reports claiming them are (See: src.commons.sync_writes)
+    if index_cls is ArticleIndex:
+        sync_writes()
+
+    with file_lock(path):
+        journal = read(path + '.journal')
+
+        # Unless the index on disk is still the one that was loaded, other processes may have written it since, so we
+        # merge into the latest version on disk
+        if index is not None and not journal and loaded_signature and loaded_signature == _get_signature(path):
+            latest_index = index
+            latest_index._get_models()
+        else:
+            latest_index = _merge_journal(index_cls, path, index_cls(path))
+            if index is not None:
+                latest_index.merge(index)
+
+        # The index must be durable before its journal is truncated
+        write(path, json.dumps(dict(latest_index)), sync=bool(journal))
+        if journal:
+            write(path + '.journal', '')
+
+
+def _flush_journal(path: str, lines: list[str]):
+    sync_writes()
+    with file_lock(path), open(path + '.journal', 'a', encoding='utf-8') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def record_mutation(name: str, key: str, model: Model):
+    """
+    Appends the state of a mutated model to the journal of the open index, so the mutation survives a crash before the
+    index is written. Mutations are fsynced in batches, and merged into the index on checkpoints.
+    :param name: The name of the index.
+    :param key: The key of the model in the index.
+    :param model: The mutated model.
+    """
+    journal = _journals.get(name)
+    if not journal:
+        return
+
+    line = json.dumps({'key': key, 'value': dict(model)}) + '\n'
+
+    with journal['lock']:
+        if not journal['buffer']:
+            journal['buffer_timestamp'] = time.time()
+
+        journal['buffer'].append(line)
+        journal['mutations_count'] += 1
+        _flush_due_mutations(journal)
+
+
+def _flush_due_mutations(journal: dict):
+    """
+    Flushes the buffered mutations of a journal, and checkpoints it, if they are due. Must hold the journal's lock.
+    """
+    flush_due = len(journal['buffer']) >= JOURNAL_BATCH_SIZE or \
+        journal['buffer'] and time.time() - journal['buffer_timestamp'] >= JOURNAL_BATCH_INTERVAL
+
+    if flush_due:
+        _flush_journal(journal['path'], journal['buffer'])
+        journal['buffer'] = []
+
+    since_checkpoint = time.time() - journal['last_checkpoint_timestamp']
+    checkpoint_due = journal['mutations_count'] >= journal['checkpoint_every'] or \
+        journal['mutations_count'] and since_checkpoint >= journal['checkpoint_interval']
+
+    if checkpoint_due:
+        _flush_journal(journal['path'], journal['buffer'])
+        _write_index(journal['index_cls'], journal['path'])
+        journal.update(buffer=[], mutations_count=0, last_checkpoint_timestamp=time.time())
+
+
+def _flush_periodically(journal: dict):
+    # Mutations are flushed even when no other mutation comes after them
+    while not journal['closed'].wait(JOURNAL_BATCH_INTERVAL):
+        with journal['lock']:
+            try:
+                _flush_due_mutations(journal)
+            except Exception as e:
+                error(f'Failed to flush the journal of: {journal["path"]}', e)
+
 
 @contextmanager
-def get_index(name: str):
-    with Lock():
+def get_index(name: str, checkpoint_every: int = 500, checkpoint_interval: float = 60):
+    """
+    :param name: The name of the index.
+    :param checkpoint_every: Count of recorded mutations after which the journal is merged into the index.
+    :param checkpoint_interval: Seconds after which the journal is merged into the index.
+    """
+    with _locks[name]:
         index_cls, path = index_map.get(name)
+
+        # Recovers the mutations journaled by a process that did not get to write its index
+        if read(path.format() + '.journal'):
+            _write_index(index_cls, path.format())
+
+        loaded_signature = _get_signature(path.format())
         index = index_cls(path.format())
 
+        prev_journal = _journals.get(name)
+        _journals[name] = dict(
+            lock=Lock(),
+            path=path.format(),
+            index_cls=index_cls,
+            buffer=[],
+            buffer_timestamp=None,
+            mutations_count=0,
+            last_checkpoint_timestamp=time.time(),
+            checkpoint_every=checkpoint_every,
+            checkpoint_interval=checkpoint_interval,
+            closed=Event()
+        )
+        journal = _journals[name]
+        flusher = Thread(target=_flush_periodically, args=(journal,), name=f'ml-studies-journal-{name}', daemon=True)
+        flusher.start()
+
         try:
             yield index
 
@@ -26,4 +172,14 @@ def get_index(name: str):
             error('Exception occurred. (There are likely details in further logs ...)', e)
 
         finally:
-            write(path.format(), json.dumps(dict(index)))
+            # No flush may write the journal once the index (which holds the buffered mutations) is written
+            journal['closed'].set()
+            flusher.join()
+
+            _journals.pop(name)
+            if prev_journal:
+                _journals[name] = prev_journal
+
+            with journal['lock']:
+                _write_index(index_cls, path.format(), index, loaded_signature)
+                journal.update(buffer=[], mutations_count=0)
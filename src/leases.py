@@ -0,0 +1,118 @@
+import os
+import socket
+import sqlite3
+import time
+from threading import local, Lock, Thread
+
+from src.commons import makedirs_from_path
+from src.enums import Paths
+
+LEASE_TTL_SECONDS = 10 * 60
+
+# Leases held by this process are renewed this often, so they don't expire however long their tasks take
+LEASE_RENEWAL_INTERVAL = LEASE_TTL_SECONDS / 5
+
+_connections = local()
+_held_keys = set()
+_held_keys_lock = Lock()
+_renewer = None
+
+
+class LeaseNotAcquired(Exception):
+    pass
+
+
+def lease_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _get_connection():
+    # sqlite connections can't be shared between threads
+    if not hasattr(_connections, 'connection'):
+        path = Paths.LEASES_DB.format()
+        makedirs_from_path(path)
+
+        connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        connection.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires_at REAL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, completed_at TEXT)')
+        _connections.connection = connection
+
+    return _connections.connection
+
+
+def renew_held_leases(ttl: float = LEASE_TTL_SECONDS):
+    """
+    Pushes back the expiry of every lease this process holds.
+    """
+    with _held_keys_lock:
+        keys = list(_held_keys)
+
+    expires_at = time.time() + ttl
+    _get_connection().executemany(
+        'UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?',
+        [(expires_at, key, lease_owner()) for key in keys]
+    )
+
+
+def _renew_periodically():
+    while True:
+        time.sleep(LEASE_RENEWAL_INTERVAL)
+        renew_held_leases()
+
+
+def acquire_lease(key: str, ttl: float = LEASE_TTL_SECONDS) -> bool:
+    """
+    Claims a key for this process, unless it is claimed by another process whose lease has not expired. Leases are
+    renewed until they are released.
+    :param key: The key to claim.
+    :param ttl: Seconds until the lease expires (unless renewed) and the key can be claimed by other processes.
+    :return: True if the lease was acquired.
+    """
+    global _renewer
+
+    timestamp = time.time()
+    cursor = _get_connection().execute(
+        'INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) '
+        'ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+        'WHERE leases.owner = excluded.owner OR leases.expires_at < ?',
+        (key, lease_owner(), timestamp + ttl, timestamp)
+    )
+    if cursor.rowcount != 1:
+        return False
+
+    with _held_keys_lock:
+        _held_keys.add(key)
+        if _renewer is None or not _renewer.is_alive():
+            _renewer = Thread(target=_renew_periodically, name='ml-studies-lease-renewer', daemon=True)
+            _renewer.start()
+    return True
+
+
+def release_lease(key: str):
+    """
+    Releases a key claimed by this process, so any process (including a restarted one) can claim it right away.
+    """
+    with _held_keys_lock:
+        _held_keys.discard(key)
+    _get_connection().execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, lease_owner()))
+
+
+def record_completion(key: str, completed_at: str):
+    """
+    Records when the work on a key was last completed (See: get_completion).
+    :param completed_at: The isoformat timestamp of the completion.
+    """
+    _get_connection().execute(
+        'INSERT INTO completions (key, completed_at) VALUES (?, ?) '
+        'ON CONFLICT (key) DO UPDATE SET completed_at = excluded.completed_at',
+        (key, completed_at)
+    )
+
+
+def get_completion(key: str) -> str | None:
+    """
+    :return: The isoformat timestamp of when the work on a key was last completed, by any process. Processes holding
+    a copy of the index older than that must not redo the work.
+    """
+    row = _get_connection().execute('SELECT completed_at FROM completions WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,296 @@
+import json
+import shutil
+from math import log
+from os.path import exists
+from os import listdir
+from threading import Lock
+
+import numpy as np
+
+from src.commons import read, write, write_with, nlp, lemmatize, try_load_json, file_lock
+from src.enums import Paths
+from src.models import ArticleIndexEntry
+
+# BM25 parameters
+K1 = 1.2
+B = .75
+
+# The newest segments are merged while the newest is at least 1 / MERGE_RATIO of the size of the one before it
+MERGE_RATIO = 2
+
+_pending_lock = Lock()
+_segment_cache = {}
+
+
+def _path(filename: str):
+    return Paths.LEMMA_INDEX.format(filename=filename)
+
+
+def add_to_lemma_index(entry: ArticleIndexEntry, occurrences: dict[str, int]):
+    """
+    Queues an analyzed article to be added to the lemma index on its next compaction.
+    :param entry: The entry of the analyzed article.
+    :param occurrences: Occurrences of each lemma in the article.
+    """
+    document = dict(filename=entry.filename, topic=entry.topic, source=entry.source, lemmas=occurrences)
+    path = _path('pending.jsonl')
+
+    with _pending_lock, file_lock(path):
+        write(path, json.dumps(document) + '\n', mode='a')
+
+
+def _get_manifest():
+    """
+    The segments of the index, oldest first. Each compaction writes a new segment (segments/{id}) holding the articles
+    queued since the last one, then makes it current by replacing segment.json, so readers never see a mix of old and
+    new files, nor a file being written. Segments are never modified once written.
+    """
+    return try_load_json(read(_path('segment.json'))) or dict(segments=[], next_id=1)
+
+
+def _segment_path(segment_id: int, filename: str):
+    return _path(f'segments/{segment_id}/{filename}')
+
+
+def _load_segment(segment_id: int, mmap_mode: str = 'r'):
+    return (
+        try_load_json(read(_segment_path(segment_id, 'vocabulary.json'))),
+        try_load_json(read(_segment_path(segment_id, 'documents.json'))),
+        np.load(_segment_path(segment_id, 'offsets.npy'), mmap_mode=mmap_mode),
+        np.load(_segment_path(segment_id, 'doc_ids.npy'), mmap_mode=mmap_mode),
+        np.load(_segment_path(segment_id, 'term_frequencies.npy'), mmap_mode=mmap_mode),
+    )
+
+
+def _get_live_masks(documents_of_segments: list[list]) -> list[np.ndarray]:
+    """
+    Articles analyzed again are added to a newer segment, whose documents are the tombstones of the previous postings
+    of these articles in older segments.
+    :param documents_of_segments: The documents of each segment, oldest first.
+    :return: Whether each document of each segment is live.
+    """
+    masks, newer_filenames = [], set()
+    for documents in reversed(documents_of_segments):
+        filenames = [d[0] for d in documents]
+        masks.append(np.array([f not in newer_filenames for f in filenames], dtype=bool))
+        newer_filenames.update(filenames)
+    return masks[::-1]
+
+
+def _merge_segments(segments: list[tuple], live_masks: list[np.ndarray]):
+    """
+    Merges segments into one, without the postings of the documents that aren't live.
+    :param segments: (vocabulary, documents, offsets, doc_ids, term_frequencies) of each segment.
+    :param live_masks: Whether each document of each segment is live (See: _get_live_masks).
+    """
+    vocabulary, vocabulary_ids, documents = [], {}, []
+    all_lemma_ids, all_doc_ids, all_term_frequencies = [], [], []
+
+    for (segment_vocabulary, segment_documents, offsets, doc_ids, term_frequencies), live in zip(segments, live_masks):
+        for lemma in segment_vocabulary:
+            if lemma not in vocabulary_ids:
+                vocabulary_ids[lemma] = len(vocabulary)
+                vocabulary.append(lemma)
+
+        lemma_ids = np.array([vocabulary_ids[lemma] for lemma in segment_vocabulary], dtype=np.int64)
+        new_doc_ids = len(documents) + np.cumsum(live) - 1
+        live_postings = live[doc_ids]
+
+        all_lemma_ids.append(np.repeat(lemma_ids, np.diff(offsets))[live_postings])
+        all_doc_ids.append(new_doc_ids[doc_ids[live_postings]])
+        all_term_frequencies.append(np.asarray(term_frequencies)[live_postings])
+        documents.extend(d for d, is_live in zip(segment_documents, live) if is_live)
+
+    lemma_ids = np.concatenate(all_lemma_ids)
+    order = np.argsort(lemma_ids, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(lemma_ids, minlength=len(vocabulary)))]).astype(np.int64)
+    doc_ids = np.concatenate(all_doc_ids).astype(np.int32)[order]
+    term_frequencies = np.concatenate(all_term_frequencies).astype(np.int32)[order]
+
+    return vocabulary, documents, offsets, doc_ids, term_frequencies
+
+
+def _get_pending_segment(pending: dict[str, dict]):
+    """
+    :return: A segment (See: _merge_segments) of the queued articles.
+    """
+    vocabulary, vocabulary_ids, documents = [], {}, []
+    lemma_ids, doc_ids, term_frequencies = [], [], []
+
+    for document in pending.values():
+        doc_id = len(documents)
+        documents.append([document['filename'], document['topic'], document['source'], sum(document['lemmas'].values())])
+
+        for lemma, occurrences in document['lemmas'].items():
+            if lemma not in vocabulary_ids:
+                vocabulary_ids[lemma] = len(vocabulary)
+                vocabulary.append(lemma)
+            lemma_ids.append(vocabulary_ids[lemma])
+            doc_ids.append(doc_id)
+            term_frequencies.append(occurrences)
+
+    lemma_ids = np.array(lemma_ids, dtype=np.int64)
+    order = np.argsort(lemma_ids, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(lemma_ids, minlength=len(vocabulary)))]).astype(np.int64)
+
+    return (
+        vocabulary,
+        documents,
+        offsets,
+        np.array(doc_ids, dtype=np.int32)[order],
+        np.array(term_frequencies, dtype=np.int32)[order]
+    )
+
+
+def _write_segment(segment_id: int, segment: tuple):
+    vocabulary, documents, offsets, doc_ids, term_frequencies = segment
+
+    arrays = dict(offsets=offsets, doc_ids=doc_ids, term_frequencies=term_frequencies)
+    for name, array in arrays.items():
+        write_with(_segment_path(segment_id, f'{name}.npy'), lambda f: np.save(f, array), sync=True)
+    write(_segment_path(segment_id, 'vocabulary.json'), json.dumps(vocabulary), sync=True)
+    write(_segment_path(segment_id, 'documents.json'), json.dumps(documents), sync=True)
+
+
+def _remove_old_segments(segment_ids: set[int]):
+    # Segments of the previous manifest are kept, for readers that loaded segment.json just before it was replaced
+    segments_path = _path('segments')
+    for name in listdir(segments_path) if exists(segments_path) else []:
+        if name.isdigit() and int(name) not in segment_ids:
+            shutil.rmtree(f'{segments_path}/{name}', ignore_errors=True)
+
+
+def compact_lemma_index():
+    """
+    Writes the queued articles into a new segment of the lemma index, in O(queued articles). The newest segments are
+    merged once they are about as big as the one before them, so there are O(log(articles)) segments, and each article
+    is merged O(log(articles)) times. Articles that were analyzed again replace their previous postings.
+    :return: The count of articles added.
+    """
+    pending_path = _path('pending.jsonl')
+
+    with file_lock(pending_path):
+        lines = (read(pending_path) or '').splitlines()
+        if not lines:
+            return 0
+
+        # The latest analysis of an article wins
+        pending = {}
+        for line in lines:
+            document = try_load_json(line)
+            if document:
+                pending[document['filename']] = document
+
+        manifest = _get_manifest()
+        segments = list(manifest['segments'])
+        merged = [_get_pending_segment(pending)]
+        merged_count = len(pending)
+
+        while segments and merged_count * MERGE_RATIO >= segments[-1]['documents']:
+            merged_count += segments[-1]['documents']
+            merged.insert(0, _load_segment(segments.pop()['id'], mmap_mode=None))
+        if len(merged) > 1:
+            merged = [_merge_segments(merged, _get_live_masks([documents for _, documents, *_ in merged]))]
+
+        segment_id = manifest['next_id']
+        _write_segment(segment_id, merged[0])
+        segments.append(dict(id=segment_id, documents=len(merged[0][1])))
+
+        write(_path('segment.json'), json.dumps(dict(segments=segments, next_id=segment_id + 1)), sync=True)
+        write(pending_path, '')
+        _remove_old_segments({s['id'] for s in segments + manifest['segments']})
+
+    return len(pending)
+
+
+def _get_segments():
+    # Segments never change, so they are only loaded once. Which documents are live is only computed again when
+    # segments were added or merged since
+    manifest = _get_manifest()
+    segment_ids = tuple(s['id'] for s in manifest['segments'])
+    cached = _segment_cache.get('live')
+
+    if not cached or cached[0] != segment_ids:
+        segments = []
+        for segment_id in segment_ids:
+            if segment_id not in _segment_cache:
+                vocabulary, documents, offsets, doc_ids, term_frequencies = _load_segment(segment_id)
+                _segment_cache[segment_id] = dict(
+                    vocabulary={lemma: i for i, lemma in enumerate(vocabulary)},
+                    documents=documents,
+                    offsets=offsets,
+                    doc_ids=doc_ids,
+                    term_frequencies=term_frequencies,
+                    topics=np.array([d[1] for d in documents], dtype=object),
+                    sources=np.array([d[2] for d in documents], dtype=object),
+                    lengths=np.array([d[3] for d in documents], dtype=np.float32),
+                )
+            segments.append(_segment_cache[segment_id])
+
+        for stale_id in [k for k in _segment_cache if isinstance(k, int) and k not in segment_ids]:
+            del _segment_cache[stale_id]
+
+        live_masks = _get_live_masks([segment['documents'] for segment in segments])
+        cached = segment_ids, list(zip(segments, live_masks))
+        _segment_cache['live'] = cached
+
+    return cached[1]
+
+
+def search_articles(query: str, limit: int = 10, topic: str = None, source: str = None) -> list[tuple[str, float]]:
+    """
+    Ranks the articles of the lemma index against a query with BM25.
+    :param query: The query. It is lemmatized the same way articles are.
+    :param limit: The maximum count of articles to return.
+    :param topic: If given, only articles of this topic are ranked.
+    :param source: If given, only articles of this source are ranked.
+    :return: (filename, score) tuples, best first.
+    """
+    segments = _get_segments()
+    documents_count = sum(int(live.sum()) for _, live in segments)
+
+    if not documents_count:
+        return []
+
+    average_length = (sum(float(segment['lengths'][live].sum()) for segment, live in segments) / documents_count) or 1
+    scores = [np.zeros(len(segment['documents']), dtype=np.float32) for segment, _ in segments]
+
+    for lemma in set(lemmatize(nlp(query))):
+        postings = []
+        for segment, live in segments:
+            lemma_id = segment['vocabulary'].get(lemma)
+            if lemma_id is None:
+                postings.append(None)
+                continue
+
+            start, end = segment['offsets'][lemma_id], segment['offsets'][lemma_id + 1]
+            doc_ids = segment['doc_ids'][start:end]
+            live_postings = live[doc_ids]
+            postings.append((doc_ids[live_postings], segment['term_frequencies'][start:end][live_postings]))
+
+        # Document frequencies are counted across segments, over live documents only
+        document_frequency = sum(len(p[0]) for p in postings if p)
+        if not document_frequency:
+            continue
+
+        idf = log(1 + (documents_count - document_frequency + .5) / (document_frequency + .5))
+        for (segment, _), segment_scores, segment_postings in zip(segments, scores, postings):
+            if segment_postings:
+                doc_ids, term_frequencies = segment_postings
+                norms = K1 * (1 - B + B * segment['lengths'][doc_ids] / average_length)
+                segment_scores[doc_ids] += idf * term_frequencies * (K1 + 1) / (term_frequencies + norms)
+
+    results = []
+    for (segment, _), segment_scores in zip(segments, scores):
+        mask = segment_scores > 0
+        if topic:
+            mask &= segment['topics'] == topic
+        if source:
+            mask &= segment['sources'] == source
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-segment_scores[candidates], limit)[:limit]]
+        results.extend((segment['documents'][i][0], float(segment_scores[i])) for i in candidates)
+
+    return sorted(results, key=lambda result: -result[1])[:limit]
@@ -0,0 +1,129 @@
+import os
+from contextlib import contextmanager
+from os.path import exists, getsize
+from threading import Condition, Lock
+
+from src.enums import ReportTypes
+from src.env import memory_budget
+
+# Estimated memory (in bytes) a task takes for every byte of its input file. Parsed html trees take about ten times the
+# size of the html, spacy docs a few hundred bytes per character of text.
+COST_PER_INPUT_BYTE = {
+    ReportTypes.EXTRACT_TEXT: 10,
+    ReportTypes.ANALYZE_TEXT: 200,
+    ReportTypes.CREATE_SENTIMENT_ANALYSIS: 20,
+}
+
+# Estimated memory (in bytes) a task takes on top of its input, and in total if its input size is unknown
+BASE_TASK_COST = 2 * 1024 * 1024
+
+# Memory is freed without notice, so tasks waiting to be admitted check the RSS again after this many seconds
+ADMISSION_RECHECK_INTERVAL = 1
+
+_condition = Condition()
+_admitted = dict(count=0, cost=0, baseline_rss=0)
+
+_peaks_lock = Lock()
+_peak_rss_by_stage = {}
+
+
+def get_rss() -> int | None:
+    """
+    Resident set size (in bytes) of this process. None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss() -> int | None:
+    """
+    Peak resident set size (in bytes) of this process since it started, or since `reset_peak_rss`.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            line = next(line for line in f if line.startswith('VmHWM:'))
+        return int(line.split()[1]) * 1024
+    except (OSError, ValueError, StopIteration):
+        return None
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def record_rss(stage: str):
+    rss = get_rss()
+    if rss is None:
+        return
+    with _peaks_lock:
+        _peak_rss_by_stage[stage] = max(_peak_rss_by_stage.get(stage, 0), rss)
+
+
+def pop_peak_rss_by_stage() -> dict[str, int]:
+    """
+    :return: The highest RSS recorded after a task of each stage, since the last call.
+    """
+    global _peak_rss_by_stage
+
+    with _peaks_lock:
+        peaks, _peak_rss_by_stage = _peak_rss_by_stage, {}
+    return peaks
+
+
+def estimate_task_cost(report_type: ReportTypes, input_path: str = None) -> int:
+    """
+    :param report_type: The report type of the task.
+    :param input_path: The path of the file the task reads, if any.
+    :return: The estimated memory (in bytes) the task takes.
+    """
+    multiplier = COST_PER_INPUT_BYTE.get(report_type)
+    if not multiplier or not input_path or not exists(input_path):
+        return BASE_TASK_COST
+    return BASE_TASK_COST + getsize(input_path) * multiplier
+
+
+@contextmanager
+def admission(cost: int):
+    """
+    Waits until the task fits in the memory budget (ML_STUDIES_MEMORY_BUDGET_MB) along with the tasks already admitted.
+    Their memory is the sum of their estimated costs on top of the RSS the process had when none was running, or the
+    current RSS if they turned out to take more. A task is always admitted if no other one is running, so tasks bigger
+    than the budget still run, one at a time. Without a budget, tasks are admitted right away.
+    :param cost: The estimated memory (in bytes) the task takes.
+    """
+    budget = memory_budget()
+    if budget is None:
+        yield
+        return
+
+    def can_be_admitted():
+        if not _admitted['count']:
+            return True
+        rss = get_rss()
+        if rss is None:
+            return True
+        # Memory running tasks already took is part of the RSS, so it isn't added to their estimates again
+        return max(rss, _admitted['baseline_rss'] + _admitted['cost']) + cost <= budget
+
+    with _condition:
+        while not can_be_admitted():
+            _condition.wait(ADMISSION_RECHECK_INTERVAL)
+        if not _admitted['count']:
+            _admitted['baseline_rss'] = get_rss() or 0
+        _admitted['count'] += 1
+        _admitted['cost'] += cost
+
+    try:
+        yield
+    finally:
+        with _condition:
+            _admitted['count'] -= 1
+            _admitted['cost'] -= cost
+            _condition.notify_all()
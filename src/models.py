@@ -5,8 +5,8 @@ from datetime import datetime, timedelta
 from enum import Enum
 from typing import Any, Callable
 
-from .enums import Status, ReportTypes
-from .commons import read, try_load_json
+from .enums import Status, ReportTypes, Paths
+from .commons import read, try_load_json, append_string, read_string, get_stable_hash, now, to_datetime
 
 
 class Model(ABC):
@@ -26,20 +26,20 @@ class Model(ABC):
                 v = dict(v)
             if isinstance(v, Enum):
                 v = v.value
+            # Copies are built here so serializing a model never replaces the models it holds with dicts
             if isinstance(v, dict):
-                for _k, _v in v.items():
-                    try:
-                        v[_k] = dict(_v or {})
-                    except Exception:
-                        v[_k] = _v
+                v = {_k: self._serialize_item(_v) for _k, _v in v.items()}
             if isinstance(v, list):
-                for i, _v in enumerate(v):
-                    try:
-                        v[i] = dict(v or {})
-                    except Exception:
-                        v[i] = _v
+                v = [self._serialize_item(_v) for _v in v]
             yield k, v
 
+    @staticmethod
+    def _serialize_item(value):
+        # Unset models (ex: reports of stages that haven't run) are serialized as empty ones
+        if value is None:
+            return {}
+        return dict(value) if isinstance(value, Model) else value
+
     def set(self, **kwargs):
         for k, v in kwargs:
             setattr(self, k, v)
@@ -52,7 +52,7 @@ class Index(Model):
         return len(self._get_models())
 
     def __init__(self, path, key, model_cls):
-        self._index = try_load_json(read(path))
+        self._index = try_load_json(read(path)) if path else {}
         self._key = key
         self._model_cls = model_cls
         self._models = {}
@@ -62,10 +62,13 @@ class Index(Model):
         return item in self._get_models()
 
     def __setitem__(self, key, value):
-        self._models[key] = value
+        self._get_models()[key] = value
 
     def __getitem__(self, item):
-        return self._models[item]
+        return self._get_models()[item]
+
+    def load_model(self, key, value: dict):
+        self[key] = self._model_cls(**value)
 
     def _get_models(self, filter_callback: Callable[[Any], bool] = None):
         if not self._models_have_been_loaded:
@@ -87,9 +90,14 @@ class Index(Model):
 
 
 class SentenceIndex(Index):
+    """
+    Sentences are keyed by a 64 bit hash of their lemmatized sequence. The sequences and original texts of sentences
+    are kept in a string table file, and are only read when needed.
+    """
     def __init__(self, path):
         super().__init__(path, 'sentences', SentenceIndexEntry)
         self.sentences = self._models
+        self._strings_path = Paths.SENTENCES_STRINGS.format()
 
     @property
     def sentences_count(self):
@@ -98,6 +106,78 @@ class SentenceIndex(Index):
     def get_sentences(self):
         return self._get_models()
 
+    def _get_models(self, filter_callback: Callable[[Any], bool] = None):
+        if not self._models_have_been_loaded:
+            # Sentences of older indexes are keyed by their sequence, and hold their text
+            sentences = self._index.get(self._key, {})
+            legacy_sentences = {k: v for k, v in sentences.items() if 'non_lemmatized_sequence' in v}
+            for sequence in legacy_sentences:
+                del sentences[sequence]
+
+            super()._get_models()
+
+            for sequence, entry in legacy_sentences.items():
+                key = self.add_sentence(sequence, entry['non_lemmatized_sequence'] or '')
+                self[key].occurred_in_articles = entry.get('occurred_in_articles', [])
+                self[key].occurrences = entry.get('occurrences', 0)
+
+        return super()._get_models(filter_callback)
+
+    def _iter_keys(self, sequence: str):
+        # Probes salted hashes of the sequence until there is no collision
+        salt = 0
+        while True:
+            yield get_stable_hash(sequence if not salt else f'{sequence}\x00{salt}')
+            salt += 1
+
+    def get_key(self, sequence: str) -> str | None:
+        """
+        :param sequence: The lemmatized sequence of the sentence.
+        :return: The key of the sentence, or None if it is not in the index.
+        """
+        sentences = self.get_sentences()
+        for key in self._iter_keys(sequence):
+            if key not in sentences:
+                return None
+            if self.get_sequence(key) == sequence:
+                return key
+
+    def add_sentence(self, sequence: str, text: str) -> str:
+        """
+        :param sequence: The lemmatized sequence of the sentence.
+        :param text: The original text of the sentence.
+        :return: The key of the new sentence.
+        """
+        sentences = self.get_sentences()
+        key = next(k for k in self._iter_keys(sequence) if k not in sentences)
+        sentences[key] = SentenceIndexEntry(
+            sequence_ref=append_string(self._strings_path, sequence),
+            text_ref=append_string(self._strings_path, text)
+        )
+        return key
+
+    def get_sequence(self, key: str) -> str:
+        return read_string(self._strings_path, self[key].sequence_ref)
+
+    def get_text(self, key: str) -> str:
+        return read_string(self._strings_path, self[key].text_ref)
+
+    def merge(self, other: SentenceIndex):
+        """
+        Merges the sentences of another (likely stale) copy of this index into this one.
+        :param other: The index to merge into this one.
+        """
+        sentences = self.get_sentences()
+        for key, entry in other.get_sentences().items():
+            if key not in sentences:
+                sentences[key] = entry
+                continue
+
+            occurred_in_articles = list(dict.fromkeys(sentences[key].occurred_in_articles + entry.occurred_in_articles))
+            sentences[key].occurred_in_articles = occurred_in_articles
+            sentences[key].occurrences = len(occurred_in_articles)
+        return self
+
 
 class ArticleIndex(Index):
     def __init__(self, path: str):
@@ -111,12 +191,68 @@ class ArticleIndex(Index):
     def get_articles(self, filter_callback: Callable[[Any], bool] = None) -> dict:
         return self._get_models(filter_callback)
 
+    def merge(self, other: ArticleIndex):
+        """
+        Merges the articles of another (likely stale) copy of this index into this one. Reports are merged one by one,
+        keeping the most recent of the two.
+        :param other: The index to merge into this one.
+        """
+        articles = self.get_articles()
+        for key, entry in other.get_articles().items():
+            if key not in articles:
+                articles[key] = entry
+                continue
+
+            reports = articles[key].reports
+
+            # Articles analyzed again are clustered again, so the story cluster of their latest analysis wins
+            analysis = reports.get(ReportTypes.ANALYZE_TEXT.value)
+            other_analysis = entry.reports.get(ReportTypes.ANALYZE_TEXT.value)
+            if other_analysis and (not analysis or other_analysis.is_more_recent_than(analysis)):
+                articles[key].story_cluster_id = entry.story_cluster_id
+            elif entry.story_cluster_id is not None:
+                articles[key].story_cluster_id = entry.story_cluster_id
+
+            for report_type, report in entry.reports.items():
+                if report and (not reports.get(report_type) or report.is_more_recent_than(reports[report_type])):
+                    reports[report_type] = report
+        return self
+
+
+class FeedIndex(Index):
+    def __init__(self, path: str):
+        super().__init__(path, 'feeds', FeedIndexEntry)
+        self.feeds = self._models
+
+    def get_feeds(self, filter_callback: Callable[[Any], bool] = None) -> dict:
+        return self._get_models(filter_callback)
+
+    def merge(self, other: FeedIndex):
+        """
+        Merges the feeds of another copy of this index into this one. Feeds are only polled by one process at a time, so
+        the feeds of the other index always win.
+        :param other: The index to merge into this one.
+        """
+        self.get_feeds().update(other.get_feeds())
+        return self
+
+
+class FeedIndexEntry(Model):
+    def __init__(self, **kwargs):
+        self.url = kwargs['url']
+        self.topic = kwargs['topic']
+        self.publish_rate = kwargs.get('publish_rate')
+        self.poll_interval = kwargs.get('poll_interval')
+        self.last_poll_timestamp = kwargs.get('last_poll_timestamp')
+        self.next_poll_timestamp = kwargs.get('next_poll_timestamp', 0)
+
 
 class SentenceIndexEntry(Model):
     def __init__(self, **kwargs):
         self.occurred_in_articles = kwargs.get('occurred_in_articles', [])
         self.occurrences = kwargs.get('occurrences', 0)
-        self.non_lemmatized_sequence = kwargs.get('non_lemmatized_sequence')
+        self.sequence_ref = kwargs.get('sequence_ref')
+        self.text_ref = kwargs.get('text_ref')
 
 
 class ArticleIndexEntry(Model):
@@ -126,6 +262,9 @@ class ArticleIndexEntry(Model):
         self.topic = kwargs['topic']
         self.filename = kwargs['filename']
         self.source = kwargs.get('source')
+        self.story_cluster_id = kwargs.get('story_cluster_id')
+        self.published = kwargs.get('published')
+        self.indexed_at = kwargs.get('indexed_at')
         self.reports = {t.value: None for t in ReportTypes}
 
         for k, v in kwargs.get('reports', {}).items():
@@ -144,15 +283,37 @@ class Report(Model):
         self.elapsed = kwargs.get('elapsed')
         self.error = kwargs.get('error')
         self.has_been_attempted = kwargs.get('has_been_attempted', False)
+        self.attempts = kwargs.get('attempts', 1 if self.has_been_attempted else 0)
         self.last_attempt_timestamp = kwargs.get('last_attempt_timestamp')
         self.additional_data = kwargs.get('additional_data', {})
 
+        # Reports from before stages were versioned are of the first version
+        self.version = kwargs.get('version', 1 if self.has_been_attempted else None)
+
     @classmethod
-    def open(cls, **kwargs):
+    def open(cls, prev: Report = None, **kwargs):
+        """
+        :param prev: The report of the previous attempt, if any. Its count of attempts is carried over.
+        """
         self = cls(**kwargs)
         self.has_been_attempted = True
+        self.attempts = (prev.attempts if prev else 0) + 1
+        self.last_attempt_timestamp = now()
         return self
 
+    def is_stale(self, report_type: ReportTypes):
+        return self.has_been_attempted and (self.version or 1) < report_type.version
+
+    def can_be_retried(self, max_attempts: int, backoff: timedelta):
+        """
+        Failed reports can be retried until they reach the max count of attempts. The backoff doubles after each attempt.
+        """
+        if self.status != Status.FAILURE or self.attempts >= max_attempts:
+            return False
+
+        last_attempt = to_datetime(self.last_attempt_timestamp)
+        return not last_attempt or now() - last_attempt >= backoff * 2 ** (self.attempts - 1)
+
     def close(self, result: Any, exception: Exception, **kwargs):
         if exception:
             self._record_failure(str(exception))
@@ -163,6 +324,12 @@ class Report(Model):
                 setattr(self, k, v)
         return self
 
+    def get_end_isoformat(self) -> str:
+        return self.end.isoformat() if isinstance(self.end, datetime) else self.end or ''
+
+    def is_more_recent_than(self, other: Report):
+        return self.get_end_isoformat() > other.get_end_isoformat()
+
     def _record_failure(self, _error: str):
         self.status = Status.FAILURE
         self.error = _error
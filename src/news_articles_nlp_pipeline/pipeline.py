@@ -4,19 +4,49 @@ from .workers import (
     scrape_articles,
     extract_texts,
     analyze_texts,
+    index_lemmas,
+    update_corpus_stats,
+    cluster_stories,
     create_sentiment_analyses,
     create_summaries,
+    stream_articles,
+    backfill_articles,
 )
 from ..env import is_env_prod
 
 
 @pipeline
-def news_articles_nlp_pipeline():
+def news_articles_nlp_pipeline(index_articles: bool = True):
     if is_env_prod():
-        index_newest_articles()
+        if index_articles:
+            index_newest_articles()
         scrape_articles()
 
     extract_texts()
     analyze_texts()
+    index_lemmas()
+    update_corpus_stats()
+    cluster_stories()
     create_sentiment_analyses()
     create_summaries()
+
+
+@pipeline
+def news_articles_nlp_streaming_pipeline(index_articles: bool = True):
+    if is_env_prod() and index_articles:
+        index_newest_articles()
+
+    stream_articles()
+    index_lemmas()
+    update_corpus_stats()
+    cluster_stories()
+    create_summaries()
+
+
+@pipeline
+def news_articles_nlp_backfill_pipeline():
+    backfill_articles()
+    index_lemmas()
+    update_corpus_stats()
+    cluster_stories()
+    create_summaries()
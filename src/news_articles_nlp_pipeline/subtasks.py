@@ -4,9 +4,9 @@ from os.path import exists
 
 import bs4
 import feedparser
-import requests
 from spacy.tokens import Token
 
+from ..cassettes import fetch
 from ..commons import write, read
 from ..decorators import subtask
 from ..enums import Paths
@@ -14,14 +14,16 @@ from ..enums import Paths
 
 @subtask(silent_success=True, silent_start=True)
 def scrape_rss_entries(rss_url) -> list[dict]:
-    return feedparser.parse(rss_url).entries
+    resp = fetch(rss_url)
+    resp.raise_for_status()
+    return feedparser.parse(resp.content).entries
 
 
 @subtask(silent_success=True, silent_start=True)
 def get_cnn_rss_urls():
     path = Paths.CNN_RSS_HTML_OUTPUT.format()
     if not exists(path):
-        resp = requests.get('https://www.cnn.com/services/rss/')
+        resp = fetch('https://www.cnn.com/services/rss/')
         resp.raise_for_status()
         write(path, resp.text)
 
@@ -37,7 +39,7 @@ def get_cnn_rss_urls():
 def get_cnn_money_rss_urls():
     path = Paths.CNN_MONEY_RSS_HTML_OUTPUT.format()
     if not exists(path):
-        resp = requests.get('https://money.cnn.com/services/rss/')
+        resp = fetch('https://money.cnn.com/services/rss/')
         resp.raise_for_status()
         write(path, resp.text)
 
@@ -1,31 +1,40 @@
 import json
 import re
+from os.path import exists
 
 import bs4
-import requests
 import contractions
 
 from textblob import TextBlob
 
-from ..commons import write, read, nlp, info, try_load_json
+from ..rate_limits import fetch_politely
+from ..commons import write, read, nlp, info, try_load_json, lemmatize
 from ..index_manager import get_index
-from ..decorators import task, log_report, threaded
+from ..lemma_index import add_to_lemma_index
+from ..corpus_stats import add_to_corpus_stats
+from ..decorators import task, log_report, threaded, leased, admitted
 from ..enums import ReportTypes, Paths
-from ..models import ArticleIndexEntry, SentenceIndexEntry
+from ..models import ArticleIndexEntry
 
 
 @threaded()
+@admitted(ReportTypes.SCRAPE_ARTICLE)
+@leased(ReportTypes.SCRAPE_ARTICLE)
 @log_report(ReportTypes.SCRAPE_ARTICLE)
 @task()
 def scrape_html(entry: ArticleIndexEntry):
     output_path = Paths.SCRAPE_HTMLS_OUTPUT.format(**dict(entry))
     
-    resp = requests.get(entry.url)
+    resp, attempts = fetch_politely(entry.url)
     resp.raise_for_status()
     write(output_path, resp.text)
 
+    return {'http_attempts': attempts}
+
 
 @threaded()
+@admitted(ReportTypes.EXTRACT_TEXT, Paths.SCRAPE_HTMLS_OUTPUT)
+@leased(ReportTypes.EXTRACT_TEXT)
 @log_report(ReportTypes.EXTRACT_TEXT)
 @task()
 def extract_text(entry: ArticleIndexEntry):
@@ -46,6 +55,8 @@ def extract_text(entry: ArticleIndexEntry):
 
 
 @threaded()
+@admitted(ReportTypes.ANALYZE_TEXT, Paths.EXTRACT_TEXTS_OUTPUT)
+@leased(ReportTypes.ANALYZE_TEXT)
 @log_report(ReportTypes.ANALYZE_TEXT)
 @task()
 def analyze_text(entry: ArticleIndexEntry):
@@ -61,29 +72,20 @@ def analyze_text(entry: ArticleIndexEntry):
         prev_sentences_count = sentence_index.sentences_count
         for i, sentence in enumerate(doc.sents):
             
-            lemmas = [
-                token.lemma_.lower() for token in sentence if
-                not token.is_stop and
-                not token.is_punct and
-                not token.like_url and
-                not token.like_email and
-                not token.text.startswith('@') and
-                not token.is_space
-            ]
+            lemmas = lemmatize(sentence)
 
             sequence = ' '.join(lemmas)
-            
-            if sequence in sentence_index and \
-                    entry.filename not in sentence_index[sequence].occurred_in_articles:
-                sentence_index[sequence].occurrences += 1
-                sentence_index[sequence].occurred_in_articles.append(entry.filename)
+            key = sentence_index.get_key(sequence)
+
+            if key and entry.filename not in sentence_index[key].occurred_in_articles:
+                sentence_index[key].occurrences += 1
+                sentence_index[key].occurred_in_articles.append(entry.filename)
                 continue
 
-            sentence_index[sequence] = SentenceIndexEntry(
-                occurrences=1,
-                occurred_in_articles=[entry.filename],
-                non_lemmatized_sequence=sentence.text
-            )
+            if not key:
+                key = sentence_index.add_sentence(sequence, sentence.text)
+                sentence_index[key].occurrences = 1
+                sentence_index[key].occurred_in_articles = [entry.filename]
 
             lemmatized_sentences.append((i, lemmas))
 
@@ -120,10 +122,21 @@ def analyze_text(entry: ArticleIndexEntry):
         'lemmatized_sentences': {i: sentence for i, sentence in lemmatized_sentences}
     }
 
+    # Articles analyzed before (e.g. backfills) take back the counts of their previous analysis
+    prev_analysis = try_load_json(read(output_path)) if exists(output_path) else {}
+    prev_occurrences = {k: v['occurrences'] for k, v in prev_analysis['lemmas'].items()} if prev_analysis else None
+
     write(output_path, json.dumps(contents))
+    add_to_lemma_index(entry, occurrences)
+    add_to_corpus_stats(entry, occurrences, prev_occurrences)
+
+    # Their story cluster was assigned from their previous analysis
+    entry.story_cluster_id = None
 
 
 @threaded()
+@admitted(ReportTypes.CREATE_SENTIMENT_ANALYSIS, Paths.ANALYZE_TEXTS_OUTPUT)
+@leased(ReportTypes.CREATE_SENTIMENT_ANALYSIS)
 @log_report(ReportTypes.CREATE_SENTIMENT_ANALYSIS)
 @task()
 def create_sentiment_analysis(entry: ArticleIndexEntry):
@@ -181,6 +194,8 @@ def create_sentiment_analysis(entry: ArticleIndexEntry):
 
 
 @threaded()
+@admitted(ReportTypes.CREATE_SUMMARY)
+@leased(ReportTypes.CREATE_SUMMARY)
 @log_report(ReportTypes.CREATE_SUMMARY)
 @task()
 def create_summary(entry: ArticleIndexEntry):
@@ -1,15 +1,162 @@
-from ..commons import info
-from ..index_manager import get_index
+import time
+from typing import Callable
+from datetime import datetime, timedelta, timezone
+
+from ..commons import (
+    info,
+    error,
+    now,
+    read_many,
+    prefetch,
+    try_load_json,
+    to_datetime,
+    get_next_poll_interval,
+    get_freshness_priority
+)
+from ..index_manager import get_index, record_mutation
 from ..decorators import worker, join_threads
-from ..env import is_env_dev
-from ..models import ArticleIndexEntry
-from ..enums import Status, ReportTypes
+from ..env import is_env_dev, is_env_prod
+from ..leases import acquire_lease, release_lease
+from ..lemma_index import compact_lemma_index
+from ..corpus_stats import flush_corpus_stats
+from ..story_clusters import assign_story_clusters
+from ..models import ArticleIndexEntry, FeedIndexEntry
+from ..enums import Status, ReportTypes, Paths
+from ..streams import stream
 from .tasks import scrape_html, extract_text, analyze_text, create_sentiment_analysis
 from .subtasks import get_cnn_rss_urls, get_cnn_money_rss_urls, scrape_rss_entries
 
 
+# Bounds (in seconds) of the interval between polls of a feed
+MIN_POLL_INTERVAL = 2 * 60
+MAX_POLL_INTERVAL = 2 * 60 * 60
+DEFAULT_POLL_INTERVAL = 30 * 60
+
+# Articles that failed to be scraped are scraped again in later runs, waiting longer after each attempt
+MAX_SCRAPE_ATTEMPTS = 5
+SCRAPE_RETRY_BACKOFF = timedelta(minutes=10)
+
+# Weight of the latest observation in the moving average of a feed's publish rate
+PUBLISH_RATE_SMOOTHING = .3
+
+# (report type, task, prod threads count) for every stage an article flows through when streaming
+STREAM_STAGES = [
+    (ReportTypes.SCRAPE_ARTICLE, scrape_html, 100),
+    (ReportTypes.EXTRACT_TEXT, extract_text, 10),
+    (ReportTypes.ANALYZE_TEXT, analyze_text, 10),
+    (ReportTypes.CREATE_SENTIMENT_ANALYSIS, create_sentiment_analysis, 10),
+]
+
+# Input files of the next this many articles are read in the background while the current ones are processed
+PREFETCH_BATCH_SIZE = 100
+
+# Progress of streams is logged every time this many articles are done with
+STREAM_PROGRESS_EVERY = 100
+
+# Topics whose articles are processed first. Ages of articles are divided by the weight of their topic (default: 1)
+TOPIC_WEIGHTS = {
+    'cnn_topstories': 3,
+    'cnn_latest': 3,
+    'cnn_world': 2,
+    'cnn_us': 2,
+    'cnn_allpolitics': 2,
+    'cnn_money_latest': 2,
+}
+
+# How much older (in seconds) an article may be than another to be processed first, for each stage it has left less
+SECONDS_PER_STAGE_LEFT = 5 * 60
+
+
+def _get_priority(entry: ArticleIndexEntry, report_type: ReportTypes):
+    stages_left = len(STREAM_STAGES) - [t for t, _, _ in STREAM_STAGES].index(report_type)
+    return get_freshness_priority(
+        to_datetime(entry.published or entry.indexed_at),
+        topic_weight=TOPIC_WEIGHTS.get(entry.topic, 1),
+        stages_left=stages_left,
+        seconds_per_stage_left=SECONDS_PER_STAGE_LEFT
+    )
+
+
+def _by_priority(entries: dict, report_type: ReportTypes) -> list[ArticleIndexEntry]:
+    return sorted(entries.values(), key=lambda e: _get_priority(e, report_type))
+
+
+def _prefetching(entries: list[ArticleIndexEntry], input_path: Paths):
+    """
+    Yields the entries, prefetching the input files of the next batch of them while the current batch is processed.
+    """
+    batches = [entries[i:i + PREFETCH_BATCH_SIZE] for i in range(0, len(entries), PREFETCH_BATCH_SIZE)]
+    if batches:
+        prefetch([input_path.format(**dict(e)) for e in batches[0]])
+
+    for i, batch in enumerate(batches):
+        if i + 1 < len(batches):
+            prefetch([input_path.format(**dict(e)) for e in batches[i + 1]])
+        yield from batch
+
+
+def _log_latencies(entries: list[ArticleIndexEntry], since: datetime):
+    """
+    Logs how long after being published the entries analyzed since the given time were analyzed.
+    """
+    latencies = []
+    for entry in entries:
+        report = entry.reports[ReportTypes.ANALYZE_TEXT.value]
+        end = to_datetime(report.end) if report else None
+
+        if not end or end < since or report.status != Status.SUCCESS:
+            continue
+
+        latency = report.additional_data.get('seconds_from_published')
+        if latency is not None:
+            latencies.append(latency)
+
+    if latencies:
+        latencies.sort()
+        p50, p95 = latencies[int(len(latencies) * .5)], latencies[int(len(latencies) * .95)]
+        info(f'Seconds from published to analysis. p50: {p50:.0f} p95: {p95:.0f} max: {latencies[-1]:.0f}')
+
+
 @worker
 def index_newest_articles():
+    # Filenames are derived from the count of entries, so only one process may index at a time
+    if not acquire_lease('index_newest_articles'):
+        info('Another process is indexing the newest articles. Skipping.')
+        return
+
+    try:
+        _index_newest_articles()
+    finally:
+        release_lease('index_newest_articles')
+
+
+def _index_rss_entries(entries: dict, topic: str, rss_entries: list[dict]) -> list[ArticleIndexEntry]:
+    new_entries = []
+
+    for rss_entry in rss_entries:
+        url = rss_entry['link']
+
+        if url not in entries and 'cnn.com' in url[:20]:
+            next_file_name = str(len(entries) + 1)
+
+            published = rss_entry.get('published_parsed')
+
+            entries[url] = ArticleIndexEntry(
+                _index=entries,
+                url=url,
+                topic=topic,
+                filename=next_file_name,
+                source='cnn',
+                published=datetime(*published[:6], tzinfo=timezone.utc) if published else None,
+                indexed_at=now()
+            )
+            new_entries.append(entries[url])
+            record_mutation('articles', url, entries[url])
+
+    return new_entries
+
+
+def _index_newest_articles():
     with get_index('articles') as index:
         prev_entries_count = index.articles_count
         entries = index.get_articles()
@@ -25,21 +172,76 @@ def index_newest_articles():
             topics_entries.append((topic, new_entries))
 
         for topic, new_entries in topics_entries:
-            for entry in new_entries:
-                url = entry['link']
+            _index_rss_entries(entries, topic, new_entries or [])
 
-                if url not in entries and 'cnn.com' in url[:20]:
-                    next_file_name = str(len(entries) + 1)
+        info(f'New entries indexed: {index.articles_count - prev_entries_count}')
 
-                    entries[url] = ArticleIndexEntry(
-                        _index=entries,
-                        url=url,
-                        topic=topic,
-                        filename=next_file_name,
-                        source='cnn'
-                    )
 
-        info(f'New entries indexed: {index.articles_count - prev_entries_count}')
+@worker
+def poll_feeds():
+    """
+    Polls the feeds that are due, then indexes and starts scraping their new articles right away. Each feed is polled
+    on its own interval, derived from the rate at which it has been publishing new articles.
+    """
+    # Same as indexing the newest articles, only one process may index at a time
+    if not acquire_lease('index_newest_articles'):
+        info('Another process is indexing the newest articles. Skipping.')
+        return
+
+    try:
+        _poll_feeds()
+    finally:
+        release_lease('index_newest_articles')
+
+
+def _poll_feeds():
+    with get_index('feeds') as feeds_index:
+        feeds = feeds_index.get_feeds()
+
+        for topic, rss_url in [*(get_cnn_rss_urls()[0] or []), *(get_cnn_money_rss_urls()[0] or [])]:
+            if rss_url not in feeds:
+                feeds[rss_url] = FeedIndexEntry(url=rss_url, topic=topic)
+
+        timestamp = time.time()
+        due_feeds = feeds_index.get_feeds(lambda _feed: _feed.next_poll_timestamp <= timestamp).values()
+
+        if not due_feeds:
+            return
+
+        with get_index('articles') as index:
+            entries = index.get_articles()
+
+            for feed in due_feeds:
+                rss_entries, exception, _ = scrape_rss_entries(feed.url)
+                new_entries = _index_rss_entries(entries, feed.topic, rss_entries or []) if not exception else []
+
+                # The first poll of a feed finds its whole backlog, which says nothing about its publish rate
+                if not exception and feed.last_poll_timestamp:
+                    observed_rate = len(new_entries) / (timestamp - feed.last_poll_timestamp)
+                    prev_rate = feed.publish_rate if feed.publish_rate is not None else observed_rate
+                    feed.publish_rate = PUBLISH_RATE_SMOOTHING * observed_rate + (1 - PUBLISH_RATE_SMOOTHING) * prev_rate
+
+                feed.last_poll_timestamp = timestamp
+                feed.poll_interval = get_next_poll_interval(
+                    feed.publish_rate,
+                    min_interval=MIN_POLL_INTERVAL,
+                    max_interval=MAX_POLL_INTERVAL,
+                    default_interval=DEFAULT_POLL_INTERVAL
+                )
+                feed.next_poll_timestamp = timestamp + feed.poll_interval
+
+                info(f'Polled feed: {feed.topic}. New entries: {len(new_entries)}. Next poll in: {int(feed.poll_interval)}s')
+
+                for entry in new_entries:
+                    scrape_html(entry)
+
+            join_threads(scrape_html)
+
+
+def _should_scrape(entry: ArticleIndexEntry):
+    report = entry.reports[ReportTypes.SCRAPE_ARTICLE.value]
+    return not report or not report.has_been_attempted or \
+        report.can_be_retried(MAX_SCRAPE_ATTEMPTS, SCRAPE_RETRY_BACKOFF)
 
 
 @worker
@@ -47,11 +249,10 @@ def scrape_articles():
 
     def filter_callback(_entry: ArticleIndexEntry):
         first_ten = int(_entry.filename) <= 10
-        attempted = _entry.reports[ReportTypes.SCRAPE_ARTICLE.value].has_been_attempted
-        return first_ten and not attempted if is_env_dev() else not attempted
+        return first_ten and _should_scrape(_entry) if is_env_dev() else _should_scrape(_entry)
 
     with get_index('articles') as index:
-        for entry in index.get_articles(filter_callback=filter_callback).values():
+        for entry in _by_priority(index.get_articles(filter_callback=filter_callback), ReportTypes.SCRAPE_ARTICLE):
             scrape_html(entry)
 
         join_threads(scrape_html)
@@ -66,7 +267,8 @@ def extract_texts():
         return prev_success if is_env_dev() else prev_success and not attempted
 
     with get_index('articles') as index:
-        for entry in index.get_articles(filter_callback=filter_callback).values():
+        entries = _by_priority(index.get_articles(filter_callback=filter_callback), ReportTypes.EXTRACT_TEXT)
+        for entry in _prefetching(entries, Paths.SCRAPE_HTMLS_OUTPUT):
             extract_text(entry)
         
         join_threads(extract_text)
@@ -81,10 +283,60 @@ def analyze_texts():
         return prev_success if is_env_dev() else prev_success and not attempted
 
     with get_index('articles') as index:
-        for entry in index.get_articles(filter_callback=filter_callback).values():
+        started = now()
+        entries = _by_priority(index.get_articles(filter_callback=filter_callback), ReportTypes.ANALYZE_TEXT)
+
+        for entry in _prefetching(entries, Paths.EXTRACT_TEXTS_OUTPUT):
             analyze_text(entry)
 
         join_threads(analyze_text)
+        _log_latencies(entries, since=started)
+
+
+@worker
+def index_lemmas():
+    info(f'Articles merged into the lemma index: {compact_lemma_index()}')
+
+
+@worker
+def update_corpus_stats():
+    info(f'Articles added to the corpus statistics: {flush_corpus_stats()}')
+
+
+@worker
+def cluster_stories():
+    # Cluster ids are assigned sequentially, so only one process may cluster at a time
+    if not acquire_lease('cluster_stories'):
+        info('Another process is clustering stories. Skipping.')
+        return
+
+    def filter_callback(_entry: ArticleIndexEntry):
+        analyzed = _entry.reports[ReportTypes.ANALYZE_TEXT.value].status == Status.SUCCESS
+        return analyzed and _entry.story_cluster_id is None
+
+    try:
+        with get_index('articles') as index:
+            entries = {e.filename: e for e in index.get_articles(filter_callback=filter_callback).values()}
+
+            documents = {}
+            analyses = read_many([Paths.ANALYZE_TEXTS_OUTPUT.format(**dict(e)) for e in entries.values()])
+            for filename, analysis in zip(entries, analyses):
+                analysis = try_load_json(analysis)
+
+                # Left unclustered, rather than alone in a story cluster, until their analysis can be read
+                if 'lemmas' not in analysis:
+                    error(f'Could not read the analysis of {filename}. Skipping.')
+                    continue
+                documents[filename] = {k: v['occurrences'] for k, v in analysis['lemmas'].items()}
+
+            cluster_ids = assign_story_clusters(documents)
+            for filename, cluster_id in cluster_ids.items():
+                entries[filename].story_cluster_id = cluster_id
+                record_mutation('articles', entries[filename].url, entries[filename])
+
+            info(f'Articles clustered: {len(cluster_ids)}. Story clusters: {len(set(cluster_ids.values()))}')
+    finally:
+        release_lease('cluster_stories')
 
 
 @worker
@@ -96,7 +348,8 @@ def create_sentiment_analyses():
         return prev_success if is_env_dev() else prev_success and not attempted
 
     with get_index('articles') as index:
-        for entry in index.get_articles(filter_callback).values():
+        entries = _by_priority(index.get_articles(filter_callback), ReportTypes.CREATE_SENTIMENT_ANALYSIS)
+        for entry in _prefetching(entries, Paths.ANALYZE_TEXTS_OUTPUT):
             create_sentiment_analysis(entry)
 
         join_threads(create_sentiment_analysis)
@@ -105,3 +358,82 @@ def create_sentiment_analyses():
 @worker
 def create_summaries():
     pass
+
+
+def _stream(entries: list[ArticleIndexEntry], get_start_position: Callable[[ArticleIndexEntry], int | None]):
+    """
+    Streams entries through the stages of STREAM_STAGES, from the position get_start_position returns for each of them.
+    Entries for which it returns None are not streamed. In dev, scraping is skipped and streams start from extracting.
+    """
+    # Scraping only happens in prod, so dev streams start from the extract stage
+    offset = 0 if is_env_prod() else 1
+    stages = STREAM_STAGES[offset:]
+
+    def get_priority(position: int, _entry: ArticleIndexEntry):
+        return _get_priority(_entry, stages[position][0])
+
+    # Items are fed in priority order, since most of them wait to be fed rather than in queues
+    items = [(p - offset, e) for e in entries if (p := get_start_position(e)) is not None and p >= offset]
+    items.sort(key=lambda item: get_priority(*item))
+    info(f'Articles to stream: {len(items)}')
+
+    stream(
+        items,
+        stages=[t.__wrapped__ for _, t, _ in stages],
+        threads_per_stage=[1 if is_env_dev() else threads_count for _, _, threads_count in stages],
+        priority_fn=get_priority,
+        log_progress_every=STREAM_PROGRESS_EVERY
+    )
+
+
+def _prev_stage_succeeded(entry: ArticleIndexEntry, position: int):
+    if position == 0:
+        return True
+    prev_report = entry.reports[STREAM_STAGES[position - 1][0].value]
+    return bool(prev_report) and prev_report.status == Status.SUCCESS
+
+
+@worker
+def stream_articles():
+    offset = 0 if is_env_prod() else 1
+
+    def get_start_position(_entry: ArticleIndexEntry):
+        for position, (report_type, _, _) in enumerate(STREAM_STAGES):
+            if position < offset:
+                continue
+
+            if not _prev_stage_succeeded(_entry, position):
+                return None
+
+            report = _entry.reports[report_type.value]
+            if is_env_dev() or not report or not report.has_been_attempted:
+                return position
+
+            if report_type == ReportTypes.SCRAPE_ARTICLE and _should_scrape(_entry):
+                return position
+
+        return None
+
+    with get_index('articles') as index:
+        started = now()
+        entries = list(index.get_articles().values())
+        _stream(entries, get_start_position)
+        _log_latencies(entries, since=started)
+
+
+@worker
+def backfill_articles():
+    """
+    Recomputes the artifacts of stages whose version was bumped (See: REPORT_TYPES_VERSIONS), for articles processed
+    by an older version, along with the artifacts of the stages after them. Up-to-date artifacts are left untouched.
+    """
+
+    def get_start_position(_entry: ArticleIndexEntry):
+        for position, (report_type, _, _) in enumerate(STREAM_STAGES):
+            report = _entry.reports[report_type.value]
+            if report and report.is_stale(report_type):
+                return position if _prev_stage_succeeded(_entry, position) else None
+        return None
+
+    with get_index('articles') as index:
+        _stream(list(index.get_articles().values()), get_start_position)
@@ -0,0 +1,107 @@
+import random
+import time
+from contextlib import contextmanager
+from threading import Lock, Condition
+from urllib.parse import urlparse
+
+import requests
+
+from src.cassettes import fetch
+
+# Bounds of the count of concurrent requests to a host, adjusted with AIMD (additive increase, multiplicative decrease)
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 100
+INITIAL_CONCURRENCY = 4
+
+# Responses slower than this (in seconds) are treated like throttled ones
+TARGET_LATENCY = 5
+
+# Seconds to wait for a host to connect, and then to respond, before giving up (and treating it like a throttled one)
+REQUEST_TIMEOUT = (TARGET_LATENCY, 3 * TARGET_LATENCY)
+
+MAX_RETRIES = 3
+RETRY_BACKOFF = 2
+
+_lock = Lock()
+_hosts = {}
+
+
+def _get_host(url: str):
+    host = urlparse(url).netloc
+    with _lock:
+        if host not in _hosts:
+            _hosts[host] = dict(
+                condition=Condition(),
+                limit=float(INITIAL_CONCURRENCY),
+                in_flight=0,
+                last_decrease_timestamp=0.
+            )
+        return _hosts[host]
+
+
+@contextmanager
+def host_slot(url: str):
+    """
+    Waits until there are less concurrent requests to the host of the url than its current concurrency limit.
+    """
+    host = _get_host(url)
+
+    with host['condition']:
+        host['condition'].wait_for(lambda: host['in_flight'] < int(host['limit']))
+        host['in_flight'] += 1
+
+    try:
+        yield host
+    finally:
+        with host['condition']:
+            host['in_flight'] -= 1
+            host['condition'].notify_all()
+
+
+def _adjust_limit(host: dict, started_timestamp: float, throttled: bool):
+    with host['condition']:
+        if throttled:
+            # Requests that were already in flight when the limit was decreased don't decrease it again
+            if started_timestamp > host['last_decrease_timestamp']:
+                host['limit'] = max(MIN_CONCURRENCY, host['limit'] / 2)
+                host['last_decrease_timestamp'] = time.time()
+        else:
+            host['limit'] = min(MAX_CONCURRENCY, host['limit'] + 1 / host['limit'])
+        host['condition'].notify_all()
+
+
+def _get_retry_delay(response: requests.Response | None, retry: int):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return RETRY_BACKOFF * 2 ** retry * random.uniform(.5, 1.5)
+
+
+def fetch_politely(url: str) -> tuple[requests.Response, int]:
+    """
+    GET request that respects the concurrency limit of the url's host, adjusts it from the response, and retries
+    (with exponential backoff) on throttling (429), server errors (5xx) and connection errors.
+    :return: The response and the count of attempts it took.
+    """
+    for retry in range(MAX_RETRIES + 1):
+        response, exception = None, None
+
+        with host_slot(url) as host:
+            started_timestamp = time.time()
+            try:
+                response = fetch(url, timeout=REQUEST_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                exception = e
+
+            elapsed = time.time() - started_timestamp
+            throttled = exception is not None or response.status_code == 429 or response.status_code >= 500
+            _adjust_limit(host, started_timestamp, throttled or elapsed > TARGET_LATENCY)
+
+        if not throttled or retry == MAX_RETRIES:
+            break
+
+        time.sleep(_get_retry_delay(response, retry))
+
+    if exception:
+        raise exception
+    return response, retry + 1
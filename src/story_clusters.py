@@ -0,0 +1,184 @@
+import json
+import zlib
+from functools import lru_cache
+from os.path import exists
+
+import numpy as np
+from scipy import sparse
+
+from src.commons import read, write, write_with, try_load_json
+from src.corpus_stats import get_idf_vector
+from src.enums import Paths
+
+# Dimensions of the hashed vectors
+FEATURES_COUNT = 2 ** 16
+
+# Random projection LSH: articles are candidate neighbours if the signatures of any of their tables differ by at most
+# one bit (multi-probe). With 32 tables of 16 bits, articles with a cosine similarity of .7 are candidates ~86% of the
+# time (~36% at .5), unrelated ones less than 1%
+TABLES_COUNT = 32
+BITS_PER_TABLE = 16
+
+# Minimum cosine similarity between an article and its nearest neighbour to join the neighbour's story cluster
+SIMILARITY_THRESHOLD = .5
+
+_projections = None
+
+
+def _path(filename: str):
+    return Paths.STORY_CLUSTERS.format(filename=filename)
+
+
+def _get_projections():
+    global _projections
+
+    # Seeded, so signatures stay comparable across runs and processes. Random signs take a quarter of the memory of
+    # gaussian projections and give the same signatures distribution
+    if _projections is None:
+        random_state = np.random.default_rng(seed=0)
+        shape = (FEATURES_COUNT, TABLES_COUNT * BITS_PER_TABLE)
+        _projections = (random_state.integers(0, 2, shape, dtype=np.int8) << 1) - 1
+    return _projections
+
+
+@lru_cache(maxsize=2 ** 20)
+def get_feature(lemma: str):
+    return zlib.crc32(lemma.encode('utf-8')) % FEATURES_COUNT
+
+
+def get_tfidf_vectors(documents: list[dict[str, int]]) -> sparse.csr_matrix:
+    """
+    Hashed TF-IDF vectors of documents, L2 normalized. Lemmas missing from the corpus statistics get the highest IDF.
+    :param documents: Occurrences of each lemma, for each document.
+    :return: A (documents count, FEATURES_COUNT) sparse matrix.
+    """
+    vocabulary, idf = get_idf_vector()
+    idf_by_lemma = dict(zip(vocabulary, idf.tolist()))
+    default_idf = float(idf.max()) if len(idf) else 1.
+
+    rows, features, values = [], [], []
+    for i, occurrences in enumerate(documents):
+        for lemma, count in occurrences.items():
+            rows.append(i)
+            features.append(get_feature(lemma))
+            values.append(count * idf_by_lemma.get(lemma, default_idf))
+
+    # Hash collisions within a document are summed
+    vectors = sparse.csr_matrix((values, (rows, features)), shape=(len(documents), FEATURES_COUNT), dtype=np.float32)
+
+    norms = np.sqrt(vectors.multiply(vectors).sum(axis=1)).A1
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(vectors).tocsr()
+
+
+def get_signatures(vectors: sparse.csr_matrix) -> np.ndarray:
+    """
+    :return: A (documents count, TABLES_COUNT) array of the LSH signatures of the vectors.
+    """
+    # Only the projections of the features the vectors have are needed
+    features = np.unique(vectors.indices)
+    bits = (vectors[:, features] @ _get_projections()[features].astype(np.float32)) > 0
+    bits = bits.reshape(-1, TABLES_COUNT, BITS_PER_TABLE)
+    return (bits * (1 << np.arange(BITS_PER_TABLE, dtype=np.int64))).sum(axis=2)
+
+
+def _get_keys(signatures: np.ndarray) -> np.ndarray:
+    # Signatures are prefixed with their table, so the signatures of every table can be searched at once
+    return signatures | (np.arange(TABLES_COUNT, dtype=np.int64) << BITS_PER_TABLE)
+
+
+def _get_probes(signatures: np.ndarray) -> np.ndarray:
+    """
+    :return: The keys of the buckets to probe for each signatures: their own, and the ones differing by one bit.
+    """
+    flips = np.concatenate([[0], 1 << np.arange(BITS_PER_TABLE, dtype=np.int64)])
+    return _get_keys(signatures)[:, :, None] ^ flips
+
+
+def _load_clusters():
+    if not exists(_path('clusters.json')):
+        return (
+            dict(filenames=[], cluster_ids=[], next_cluster_id=1, lsh=[TABLES_COUNT, BITS_PER_TABLE]),
+            sparse.csr_matrix((0, FEATURES_COUNT), dtype=np.float32),
+            np.zeros((0, TABLES_COUNT), dtype=np.int64)
+        )
+
+    clusters = try_load_json(read(_path('clusters.json')))
+    vectors = sparse.load_npz(_path('vectors.npz')).tocsr()
+    signatures = np.load(_path('signatures.npy'))
+
+    # Signatures computed with other LSH parameters are computed again
+    if clusters.get('lsh') != [TABLES_COUNT, BITS_PER_TABLE]:
+        clusters['lsh'] = [TABLES_COUNT, BITS_PER_TABLE]
+        signatures = get_signatures(vectors)
+
+    return clusters, vectors, signatures
+
+
+def assign_story_clusters(documents: dict[str, dict[str, int]]) -> dict[str, int]:
+    """
+    Assigns articles to the story cluster of their nearest (previously clustered) neighbour, or to a new story cluster
+    if none is similar enough. Nearest neighbours are approximated with random projection LSH.
+    :param documents: Occurrences of each lemma, for each filename of the articles to cluster.
+    :return: The story cluster id of each filename.
+    """
+    clusters, vectors, signatures = _load_clusters()
+    filenames = list(documents)
+    if not filenames:
+        return {}
+
+    # Articles clustered before (e.g. analyzed again by a backfill) replace their previous vector
+    kept = np.array([f not in documents for f in clusters['filenames']], dtype=bool)
+    if not kept.all():
+        vectors, signatures = vectors[kept], signatures[kept]
+        clusters['filenames'] = [f for f, k in zip(clusters['filenames'], kept) if k]
+        clusters['cluster_ids'] = [c for c, k in zip(clusters['cluster_ids'], kept) if k]
+
+    new_vectors = get_tfidf_vectors([documents[f] for f in filenames])
+    new_signatures = get_signatures(new_vectors)
+
+    prev_count = vectors.shape[0]
+    vectors = sparse.vstack([vectors, new_vectors]).tocsr()
+    signatures = np.concatenate([signatures, new_signatures])
+    cluster_ids = clusters['cluster_ids']
+
+    # Buckets of every table, as the keys of all the signatures, sorted
+    keys = _get_keys(signatures).ravel()
+    order = np.argsort(keys, kind='stable')
+    sorted_keys, sorted_rows = keys[order], order // TABLES_COUNT
+
+    probes = _get_probes(new_signatures).reshape(len(filenames), -1)
+    starts = np.searchsorted(sorted_keys, probes, side='left')
+    ends = np.searchsorted(sorted_keys, probes, side='right')
+
+    assigned = {}
+    for i, filename in enumerate(filenames):
+        row = prev_count + i
+
+        lengths = ends[i] - starts[i]
+        positions = np.repeat(starts[i] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        candidates = np.unique(sorted_rows[positions])
+
+        # Articles are only compared to the ones clustered before them
+        candidates = candidates[candidates < row]
+
+        cluster_id = None
+        if len(candidates):
+            similarities = vectors[candidates] @ new_vectors[i].toarray().ravel()
+            best = similarities.argmax()
+            if similarities[best] >= SIMILARITY_THRESHOLD:
+                cluster_id = cluster_ids[candidates[best]]
+
+        if cluster_id is None:
+            cluster_id = clusters['next_cluster_id']
+            clusters['next_cluster_id'] += 1
+
+        cluster_ids.append(cluster_id)
+        clusters['filenames'].append(filename)
+        assigned[filename] = cluster_id
+
+    write_with(_path('vectors.npz'), lambda f: sparse.save_npz(f, vectors, compressed=False))
+    write_with(_path('signatures.npy'), lambda f: np.save(f, signatures))
+    write(_path('clusters.json'), json.dumps(clusters))
+
+    return assigned
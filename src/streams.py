@@ -0,0 +1,105 @@
+from itertools import count
+from queue import PriorityQueue
+from threading import Thread, Lock
+from typing import Callable, Iterable, Any
+
+from src.commons import error, info, now
+from src.decorators import try_catch
+
+_END = object()
+
+# Breaks ties between equal priorities, in order of insertion
+_sequence = count()
+
+
+def _log_progress(progress: dict):
+    with progress['lock']:
+        progress['done'] += 1
+        done, total = progress['done'], progress['total']
+        if not progress['log_every'] or done % progress['log_every'] and done != total:
+            return
+
+    elapsed = now() - progress['start']
+    message = f'Stream progress: {done}' + (f'/{total} ({done / total:.0%})' if total else '')
+    if total:
+        message += f'. Elapsed: {str(elapsed)}. ETA: {str(elapsed / done * (total - done))}'
+    info(message)
+
+
+def _run_stage(
+        position: int,
+        fn: Callable,
+        queues: list[PriorityQueue],
+        priority_fn: Callable[[int, Any], float],
+        progress: dict
+):
+    queue = queues[position]
+    next_queue = queues[position + 1] if position + 1 < len(queues) else None
+
+    while (item := queue.get()[2]) is not _END:
+        result, unexpected_exception = try_catch(fn)(item)
+
+        if unexpected_exception:
+            error(f'Unexpected error in stage: {fn.__name__}', unexpected_exception)
+
+        # Items only flow downstream if the stage succeeded
+        if not unexpected_exception and not result[1] and next_queue is not None:
+            next_queue.put((priority_fn(position + 1, item), next(_sequence), item))
+        else:
+            _log_progress(progress)
+
+
+def stream(
+        items: Iterable[tuple[int, Any]],
+        stages: list[Callable],
+        threads_per_stage: list[int],
+        max_queue_size: int = 100,
+        priority_fn: Callable[[int, Any], float] = None,
+        log_progress_every: int = None
+):
+    """
+    Runs items through a series of stages connected by bounded queues. An item is handed to the next stage as soon as
+    the current stage succeeds on it, so stages overlap instead of waiting on each other. Producers block on full
+    queues (backpressure) which keeps the count of items in flight bounded by the queue sizes.
+    :param items: Iterable of (start stage position, item) tuples. Consumed lazily.
+    :param stages: Fns to run on each item. Each must be synchronous and return a (result, exception) tuple.
+    :param threads_per_stage: Count of threads consuming each stage's queue.
+    :param max_queue_size: The maximum count of items waiting in each stage's queue.
+    :param priority_fn: Priority (the lower, the sooner) of an item in the queue of a stage, given the stage position and
+    the item. If none, items are processed in order.
+    :param log_progress_every: If given, progress (and ETA, if items is sized) is logged every time this many items
+    are done with, whether they made it through every stage or not.
+    """
+    priority_fn = priority_fn or (lambda position, item: 0)
+    progress = dict(
+        lock=Lock(),
+        done=0,
+        total=len(items) if hasattr(items, '__len__') else None,
+        log_every=log_progress_every,
+        start=now()
+    )
+    queues = [PriorityQueue(maxsize=max_queue_size) for _ in stages]
+    threads = []
+
+    for position, (fn, threads_count) in enumerate(zip(stages, threads_per_stage)):
+        stage_threads = [
+            Thread(
+                target=_run_stage,
+                args=(position, fn, queues, priority_fn, progress),
+                daemon=True,
+                name=f'ml-studies-s{position}-{i + 1}'
+            ) for i in range(threads_count)
+        ]
+        for t in stage_threads:
+            t.start()
+        threads.append(stage_threads)
+
+    for position, item in items:
+        queues[position].put((priority_fn(position, item), next(_sequence), item))
+
+    # Stages are drained in order so upstream stages can't hand items to a stage that has already shut down
+    for queue, stage_threads in zip(queues, threads):
+        for _ in stage_threads:
+            queue.put((float('inf'), next(_sequence), _END))
+        for t in stage_threads:
+            t.join()
@@ -0,0 +1,34 @@
+import requests
+
+from src import cassettes
+from src.cassettes import fetch
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('ML_STUDIES_ENV', 'dev')
+    monkeypatch.setattr(cassettes, '_recordings', None)
+    monkeypatch.setattr(cassettes, '_replay_positions', {})
+
+    def get(url, **kwargs):
+        # Redirected, like most feeds and article links
+        response = requests.Response()
+        response.url = url.replace('http://', 'https://')
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response._content = f'<p>{url}</p>'.encode('utf-8')
+        return response
+
+    monkeypatch.setattr(cassettes.requests, 'get', get)
+    monkeypatch.setenv('ML_STUDIES_CASSETTE', 'record')
+    fetch('http://a.com/feed')
+    fetch('http://b.com/article')
+
+    monkeypatch.setattr(cassettes.requests, 'get', None)
+    monkeypatch.setenv('ML_STUDIES_CASSETTE', 'replay')
+    response = fetch('http://a.com/feed')
+
+    assert response.url == 'https://a.com/feed'
+    assert response.status_code == 200
+    assert response.text == '<p>http://a.com/feed</p>'
+    assert fetch('http://b.com/article').text == '<p>http://b.com/article</p>'
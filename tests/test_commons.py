@@ -1,4 +1,18 @@
-from src.commons import get_levenshtein_distance as fn, get_sentence_similarity_score
+from datetime import timedelta
+
+from src.commons import (
+    get_levenshtein_distance as fn,
+    get_sentence_similarity_score,
+    get_next_poll_interval,
+    get_freshness_priority,
+    read,
+    read_many,
+    write,
+    write_with,
+    prefetch,
+    sync_writes,
+    now
+)
 
 
 def test_get_levenshtein_distance():
@@ -23,3 +37,44 @@ def test_get_sentence_similarity_score():
 
     score = get_sentence_similarity_score(s1, s2)
     assert score == .96
+
+
+def test_get_next_poll_interval():
+    kwargs = dict(min_interval=60, max_interval=3600, default_interval=1800, jitter=0)
+
+    assert get_next_poll_interval(None, **kwargs) == 1800
+    assert get_next_poll_interval(0, **kwargs) == 3600
+    assert get_next_poll_interval(1 / 600, **kwargs) == 600
+    assert get_next_poll_interval(1, **kwargs) == 60
+    assert 60 <= get_next_poll_interval(1 / 60, **{**kwargs, 'jitter': .5}) <= 90
+
+
+def test_get_freshness_priority():
+    kwargs = dict(topic_weight=1, stages_left=4, seconds_per_stage_left=300)
+
+    fresh = get_freshness_priority(now() - timedelta(minutes=5), **kwargs)
+    old = get_freshness_priority(now() - timedelta(days=2), **kwargs)
+    unknown = get_freshness_priority(None, **kwargs)
+    heavy_topic = get_freshness_priority(now() - timedelta(minutes=12), **{**kwargs, 'topic_weight': 3})
+    almost_done = get_freshness_priority(now() - timedelta(minutes=14), **{**kwargs, 'stages_left': 1})
+
+    assert fresh < old < unknown
+    assert heavy_topic < fresh
+    assert almost_done < fresh
+
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / 'a' / 'b' / 'file.txt')
+
+    write(path, 'first')
+    prefetch([path])
+    write(path, 'second')
+    write(path, '!', mode='a')
+
+    assert read(path) == 'second!'
+    assert read_many([path, path + '.missing']) == ['second!', None]
+    assert sorted(p.name for p in (tmp_path / 'a' / 'b').iterdir()) == ['file.txt']
+    assert sync_writes() >= 1
+
+    write_with(path, lambda f: f.write(b'bytes'))
+    assert read(path, mode='rb') == b'bytes'
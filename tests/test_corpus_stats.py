@@ -0,0 +1,72 @@
+import numpy as np
+from scipy import sparse
+
+from src import corpus_stats
+from src.corpus_stats import merge_corpus_stats, get_idf_vector, load_corpus_stats, add_to_corpus_stats, flush_corpus_stats
+from src.models import ArticleIndexEntry
+
+
+def test_merge_corpus_stats(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    stats = load_corpus_stats()
+    stats['documents'] = ['1']
+    stats['vocabulary'] = ['cat']
+    stats['vocabulary_ids'] = {'cat': 0}
+    stats['topics'] = ['pets']
+    stats['topic_ids'] = {'pets': 0}
+    stats['document_frequencies'] = np.array([1])
+    stats['token_counts'] = np.array([3])
+    stats['topic_document_counts'] = np.array([1])
+    stats['topic_token_counts'] = sparse.csr_matrix(np.array([[3]]))
+
+    other = load_corpus_stats()
+    other['documents'] = ['2']
+    other['vocabulary'] = ['dog', 'cat']
+    other['vocabulary_ids'] = {'dog': 0, 'cat': 1}
+    other['topics'] = ['news']
+    other['topic_ids'] = {'news': 0}
+    # Capacity beyond the vocabulary and topics is ignored
+    other['document_frequencies'] = np.array([1, 1, 0, 0])
+    other['token_counts'] = np.array([2, 1, 0, 0])
+    other['topic_document_counts'] = np.array([1, 0])
+    other['topic_token_counts'] = sparse.csr_matrix(np.array([[2, 1]]))
+
+    stats = merge_corpus_stats(stats, other)
+
+    assert stats['vocabulary'] == ['cat', 'dog']
+    assert stats['topics'] == ['pets', 'news']
+    assert stats['document_frequencies'][:2].tolist() == [2, 1]
+    assert stats['token_counts'][:2].tolist() == [4, 2]
+    assert stats['topic_token_counts'].toarray().tolist() == [[3, 0], [1, 2]]
+
+    vocabulary, idf = get_idf_vector(stats)
+    assert idf[0] < idf[1]
+
+
+def test_add_to_corpus_stats_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(corpus_stats, '_delta', None)
+    monkeypatch.setattr(corpus_stats, '_counted_documents', None)
+    entry = ArticleIndexEntry(url='a', topic='pets', filename='1')
+
+    add_to_corpus_stats(entry, {'cat': 3, 'dog': 1})
+    assert flush_corpus_stats() == 1
+
+    # Already counted, and not analyzed again
+    add_to_corpus_stats(entry, {'cat': 3, 'dog': 1})
+    assert flush_corpus_stats() == 0
+
+    # Analyzed again (e.g. backfilled): the previous counts are replaced
+    add_to_corpus_stats(entry, {'cat': 2, 'bird': 1}, prev_occurrences={'cat': 3, 'dog': 1})
+    assert flush_corpus_stats() == 1
+
+    stats = load_corpus_stats()
+    counts = dict(zip(stats['vocabulary'], stats['token_counts'].tolist()))
+    frequencies = dict(zip(stats['vocabulary'], stats['document_frequencies'].tolist()))
+    assert stats['documents'] == ['1']
+    assert counts == {'cat': 2, 'dog': 0, 'bird': 1}
+    assert frequencies == {'cat': 1, 'dog': 0, 'bird': 1}
+    assert stats['topic_document_counts'].tolist() == [1]
+    assert stats['topic_token_counts'].toarray().tolist() == [[2, 0, 1]]
+    assert stats['topic_token_counts'].nnz == 2
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from src.commons import now
+from src.decorators import log_report, task
+from src.enums import ReportTypes, Status
+from src.models import ArticleIndexEntry
+
+
+def test_log_report():
+    entry = ArticleIndexEntry(url='a', topic='t', filename='1', published=now() - timedelta(minutes=10))
+
+    @log_report(ReportTypes.ANALYZE_TEXT)
+    @task()
+    def analyze(_entry: ArticleIndexEntry):
+        pass
+
+    analyze(entry)
+    report = entry.reports[ReportTypes.ANALYZE_TEXT.value]
+
+    assert report.status == Status.SUCCESS
+    assert report.version == ReportTypes.ANALYZE_TEXT.version
+    assert 600 <= report.additional_data['seconds_from_published'] < 660
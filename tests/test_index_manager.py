@@ -0,0 +1,77 @@
+import os
+import time
+from multiprocessing import get_context
+from threading import enumerate as enumerate_threads
+
+from src import index_manager
+from src.commons import read
+from src.index_manager import get_index, record_mutation
+from src.models import ArticleIndexEntry
+
+
+def _mutate_and_crash():
+    with get_index('articles', checkpoint_interval=60) as index:
+        for i in range(5):
+            entry = ArticleIndexEntry(url=f'url-{i}', topic='t', filename=str(i))
+            index[entry.url] = entry
+            record_mutation('articles', entry.url, entry)
+
+        # Less than a batch of mutations, and none after them: they are flushed by time
+        time.sleep(.5)
+        os._exit(1)
+
+
+def test_journal_replay_after_crash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(index_manager, 'JOURNAL_BATCH_INTERVAL', .1)
+
+    process = get_context('fork').Process(target=_mutate_and_crash)
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+
+    # Exceptions raised while an index is open are logged rather than raised, so assertions are made after closing it
+    with get_index('articles') as index:
+        articles = index.get_articles()
+
+    assert sorted(articles) == [f'url-{i}' for i in range(5)]
+
+
+def test_write_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with get_index('articles') as index:
+        index['a'] = ArticleIndexEntry(url='a', topic='t', filename='1')
+
+    # Closing an index that was not read keeps its entries
+    with get_index('articles'):
+        pass
+
+    # Entries written by another process while the index is open are merged
+    with get_index('articles') as index:
+        with get_index('articles') as other_index:
+            other_index['b'] = ArticleIndexEntry(url='b', topic='t', filename='2')
+        index['c'] = ArticleIndexEntry(url='c', topic='t', filename='3')
+
+    with get_index('articles') as index:
+        articles = index.get_articles()
+
+    assert sorted(articles) == ['a', 'b', 'c']
+
+
+def test_close_index_stops_flushing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(index_manager, 'JOURNAL_BATCH_INTERVAL', .01)
+
+    with get_index('articles') as index:
+        entry = ArticleIndexEntry(url='a', topic='t', filename='1')
+        index[entry.url] = entry
+        record_mutation('articles', entry.url, entry)
+        journal = index_manager._journals['articles']
+
+    assert not any(t.name == 'ml-studies-journal-articles' for t in enumerate_threads())
+    assert journal['buffer'] == []
+
+    # Nothing is flushed to the journal once the index holding the mutations is written
+    time.sleep(.05)
+    assert not read(index_manager.index_map['articles'][1].format() + '.journal')
@@ -0,0 +1,67 @@
+from threading import local
+
+from src import leases
+from src.decorators import leased, log_report, task
+from src.enums import ReportTypes
+from src.leases import acquire_lease, release_lease, renew_held_leases, LeaseNotAcquired
+from src.models import ArticleIndexEntry
+
+
+def _use_leases_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(leases, '_connections', local())
+    monkeypatch.setattr(leases, '_held_keys', set())
+
+
+def test_release_lets_other_processes_acquire(tmp_path, monkeypatch):
+    _use_leases_db(tmp_path, monkeypatch)
+    owner = leases.lease_owner()
+
+    assert acquire_lease('key')
+    monkeypatch.setattr(leases, 'lease_owner', lambda: 'restarted:1')
+    assert not acquire_lease('key')
+
+    monkeypatch.setattr(leases, 'lease_owner', lambda: owner)
+    release_lease('key')
+    monkeypatch.setattr(leases, 'lease_owner', lambda: 'restarted:1')
+    assert acquire_lease('key')
+
+
+def test_held_leases_are_renewed(tmp_path, monkeypatch):
+    _use_leases_db(tmp_path, monkeypatch)
+    owner = leases.lease_owner()
+
+    # Already expired, as a lease held by a long task would be without renewal
+    assert acquire_lease('key', ttl=-1)
+    renew_held_leases()
+
+    monkeypatch.setattr(leases, 'lease_owner', lambda: 'other:1')
+    assert not acquire_lease('key')
+
+    monkeypatch.setattr(leases, 'lease_owner', lambda: owner)
+    release_lease('key')
+
+
+def test_leased_skips_entries_completed_elsewhere(tmp_path, monkeypatch):
+    _use_leases_db(tmp_path, monkeypatch)
+    calls = []
+
+    @leased(ReportTypes.ANALYZE_TEXT)
+    @log_report(ReportTypes.ANALYZE_TEXT)
+    @task()
+    def analyze(_entry: ArticleIndexEntry):
+        calls.append(_entry.url)
+
+    first = ArticleIndexEntry(url='a', topic='t', filename='1')
+    analyze(first)
+    assert calls == ['a']
+
+    # Another process holding a copy of the index loaded before the entry was analyzed
+    stale = ArticleIndexEntry(url='a', topic='t', filename='1')
+    _, err = analyze(stale)
+    assert isinstance(err, LeaseNotAcquired)
+    assert calls == ['a']
+
+    # The process that completed the entry still redoes it when asked to (e.g. retries and backfills)
+    analyze(first)
+    assert calls == ['a', 'a']
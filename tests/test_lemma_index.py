@@ -0,0 +1,63 @@
+from os import listdir
+
+import pytest
+
+from src import lemma_index
+from src.lemma_index import add_to_lemma_index, compact_lemma_index, search_articles
+from src.models import ArticleIndexEntry
+
+
+def _add(filename: str, topic: str, source: str, occurrences: dict[str, int]):
+    entry = ArticleIndexEntry(url=filename, topic=topic, source=source, filename=filename)
+    add_to_lemma_index(entry, occurrences)
+
+
+def test_lemma_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(lemma_index, 'lemmatize', lambda tokens: [t.text.lower() for t in tokens])
+
+    _add('1', 'world', 'cnn', {'storm': 5, 'coast': 1})
+    _add('2', 'world', 'cnn', {'storm': 1, 'election': 3})
+    _add('3', 'money', 'cnn-money', {'market': 4, 'storm': 1, 'filler': 20})
+    assert compact_lemma_index() == 3
+    assert compact_lemma_index() == 0
+
+    # Most occurrences (relative to the length of the article) first
+    assert [f for f, _ in search_articles('storm')] == ['1', '2', '3']
+    assert [f for f, _ in search_articles('storm', limit=1)] == ['1']
+    assert [f for f, _ in search_articles('storm coast')][0] == '1'
+    assert [f for f, _ in search_articles('storm', topic='money')] == ['3']
+    assert [f for f, _ in search_articles('storm', source='cnn')] == ['1', '2']
+    assert search_articles('unknown') == []
+
+    # Analyzing an article again replaces its postings, from a new segment
+    monkeypatch.setattr(lemma_index, 'MERGE_RATIO', 0)
+    _add('1', 'world', 'cnn', {'election': 1})
+    _add('4', 'world', 'cnn', {'coast': 2})
+    assert compact_lemma_index() == 2
+    assert len(lemma_index._get_manifest()['segments']) == 2
+
+    assert [f for f, _ in search_articles('storm')] == ['2', '3']
+    assert sorted(f for f, _ in search_articles('election')) == ['1', '2']
+    assert sorted(f for f, _ in search_articles('coast')) == ['4']
+
+    _add('4', 'world', 'cnn', {'coast': 1, 'storm': 1})
+    compact_lemma_index()
+    _add('5', 'world', 'cnn', {'market': 1})
+    compact_lemma_index()
+    assert sorted(f for f, _ in search_articles('storm')) == ['2', '3', '4']
+    scores = dict(search_articles('storm coast'))
+
+    # Segments about as big as the one before them are merged, without the postings replaced since
+    monkeypatch.setattr(lemma_index, 'MERGE_RATIO', 2)
+    _add('4', 'world', 'cnn', {'coast': 1, 'storm': 1})
+    compact_lemma_index()
+
+    assert [s['documents'] for s in lemma_index._get_manifest()['segments']] == [5]
+    assert dict(search_articles('storm coast')) == pytest.approx(scores)
+
+    # Segments of the previous manifest are kept, for readers that loaded it just before it was replaced
+    assert sorted(listdir(lemma_index._path('segments'))) == ['1', '2', '3', '4', '5']
+    _add('6', 'world', 'cnn', {'market': 1})
+    compact_lemma_index()
+    assert sorted(listdir(lemma_index._path('segments'))) == ['5', '6']
@@ -0,0 +1,38 @@
+import time
+from threading import Thread, Lock
+
+from src import memory
+from src.memory import admission
+
+MB = 1024 * 1024
+
+
+def test_admission(monkeypatch):
+    running, peak, lock = [0], [0], Lock()
+
+    # Running tasks have already taken most of the memory they were estimated to take
+    monkeypatch.setattr(memory, 'get_rss', lambda: 100 * MB + running[0] * 25 * MB)
+    monkeypatch.setattr(memory, 'ADMISSION_RECHECK_INTERVAL', .01)
+    monkeypatch.setenv('ML_STUDIES_MEMORY_BUDGET_MB', '200')
+
+    def run_task():
+        with admission(30 * MB):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(.05)
+            with lock:
+                running[0] -= 1
+
+    threads = [Thread(target=run_task) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 100 MB + 3 * 30 MB fit in the budget, a fourth task doesn't
+    assert peak[0] == 3
+
+    # A task bigger than the budget still runs, alone
+    with admission(500 * MB):
+        pass
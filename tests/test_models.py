@@ -0,0 +1,106 @@
+import json
+from datetime import datetime, timezone
+
+from src import enums, models
+from src.enums import ReportTypes
+from src.index_manager import get_index
+from src.models import ArticleIndex, ArticleIndexEntry, Report, SentenceIndex
+
+
+def test_article_index_merge():
+    older = Report.open().close(None, Exception('Oops'), end=datetime(2022, 1, 1, tzinfo=timezone.utc))
+    newer = Report.open().close(None, None, end=datetime(2022, 1, 2, tzinfo=timezone.utc))
+
+    latest_index = ArticleIndex('does-not-exist.json')
+    latest_index['a'] = ArticleIndexEntry(url='a', topic='t', filename='1', reports={'extract_texts': older})
+
+    stale_index = ArticleIndex('does-not-exist.json')
+    stale_index['a'] = ArticleIndexEntry(url='a', topic='t', filename='1', reports={'scrape_articles': newer})
+    stale_index['b'] = ArticleIndexEntry(url='b', topic='t', filename='2')
+
+    articles = latest_index.merge(stale_index).get_articles()
+
+    assert set(articles) == {'a', 'b'}
+    assert articles['a'].reports['scrape_articles'] is newer
+    assert articles['a'].reports['extract_texts'] is older
+
+
+def test_report_is_stale(monkeypatch):
+    monkeypatch.setitem(enums.REPORT_TYPES_VERSIONS, ReportTypes.EXTRACT_TEXT, 2)
+
+    assert Report(has_been_attempted=True).is_stale(ReportTypes.EXTRACT_TEXT)
+    assert Report.open(version=1).is_stale(ReportTypes.EXTRACT_TEXT)
+    assert not Report.open(version=2).is_stale(ReportTypes.EXTRACT_TEXT)
+    assert not Report().is_stale(ReportTypes.EXTRACT_TEXT)
+
+
+def test_sentence_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    path = tmp_path / 'sentence-index.json'
+    path.write_text(json.dumps({'sentences': {
+        'old sentence': {'occurrences': 2, 'occurred_in_articles': ['1', '2'], 'non_lemmatized_sequence': 'Old sentence.'}
+    }}))
+
+    sentence_index = SentenceIndex(str(path))
+
+    key = sentence_index.get_key('old sentence')
+    assert sentence_index[key].occurrences == 2
+    assert sentence_index.get_text(key) == 'Old sentence.'
+
+    # Every sequence collides, only salted sequences have different hashes
+    monkeypatch.setattr(models, 'get_stable_hash', lambda value: 'same' + value.partition('\x00')[2])
+
+    key = sentence_index.add_sentence('new sentence', 'New sentence!')
+    other_key = sentence_index.add_sentence('other sentence', 'Other sentence?')
+
+    assert key != other_key
+    assert sentence_index.get_key('new sentence') == key
+    assert sentence_index.get_key('other sentence') == other_key
+    assert sentence_index.get_key('missing sentence') is None
+    assert sentence_index.get_text(other_key) == 'Other sentence?'
+
+
+def test_index_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with get_index('sentences') as sentence_index:
+        first_key = sentence_index.add_sentence('first sentence', 'First sentence.')
+        sentence_index[first_key].occurrences = 1
+        sentence_index[first_key].occurred_in_articles = ['1']
+
+    with get_index('articles') as article_index:
+        report = Report.open().close(None, None, additional_data={'seconds_from_published': 0.})
+        article_index['a'] = ArticleIndexEntry(url='a', topic='t', filename='1', reports={'analyze_text': report})
+
+    # Exceptions raised while an index is open are logged rather than raised, so assertions are made after closing it
+    with get_index('sentences') as sentence_index:
+        key = sentence_index.get_key('first sentence')
+        text = sentence_index.get_text(key)
+
+    with get_index('articles') as article_index:
+        report = article_index['a'].reports['analyze_text']
+
+    assert key == first_key
+    assert text == 'First sentence.'
+    assert report.additional_data == {'seconds_from_published': 0.}
+
+
+def test_article_index_merge_story_clusters():
+    older = Report.open().close(None, None, end=datetime(2022, 1, 1, tzinfo=timezone.utc))
+    newer = Report.open().close(None, None, end=datetime(2022, 1, 2, tzinfo=timezone.utc))
+
+    def index(story_cluster_id, analysis):
+        _index = ArticleIndex('does-not-exist.json')
+        _index['a'] = ArticleIndexEntry(
+            url='a', topic='t', filename='1', story_cluster_id=story_cluster_id,
+            reports={ReportTypes.ANALYZE_TEXT.value: analysis}
+        )
+        return _index
+
+    # Clustered by another process
+    assert index(None, older).merge(index(4, older))['a'].story_cluster_id == 4
+    # A stale copy of the index doesn't know about the cluster
+    assert index(4, older).merge(index(None, older))['a'].story_cluster_id == 4
+    # Analyzed again, so clustered again
+    assert index(4, older).merge(index(None, newer))['a'].story_cluster_id is None
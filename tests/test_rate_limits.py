@@ -0,0 +1,53 @@
+import time
+
+import requests
+
+from src import rate_limits
+from src.rate_limits import _adjust_limit, _get_host, _get_retry_delay, fetch_politely, INITIAL_CONCURRENCY
+
+
+def _response(status_code: int, headers: dict = None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+def test_adjust_limit(monkeypatch):
+    monkeypatch.setattr(rate_limits, '_hosts', {})
+    host = _get_host('https://a.com/article')
+
+    # Additive increase
+    _adjust_limit(host, time.time(), throttled=False)
+    assert host['limit'] == INITIAL_CONCURRENCY + 1 / INITIAL_CONCURRENCY
+
+    # Multiplicative decrease, only once for the requests that were already in flight
+    started_timestamp = time.time()
+    _adjust_limit(host, started_timestamp, throttled=True)
+    _adjust_limit(host, started_timestamp, throttled=True)
+    assert host['limit'] == (INITIAL_CONCURRENCY + 1 / INITIAL_CONCURRENCY) / 2
+
+    _adjust_limit(host, time.time() + 1, throttled=True)
+    assert host['limit'] == (INITIAL_CONCURRENCY + 1 / INITIAL_CONCURRENCY) / 4
+
+
+def test_get_retry_delay():
+    assert _get_retry_delay(_response(429, {'Retry-After': '7'}), retry=0) == 7
+    assert 1 <= _get_retry_delay(_response(429), retry=0) <= 3
+    assert 2 <= _get_retry_delay(None, retry=1) <= 6
+
+
+def test_fetch_politely(monkeypatch):
+    monkeypatch.setattr(rate_limits, '_hosts', {})
+    responses = [_response(429, {'Retry-After': '3'}), _response(503), _response(200)]
+    sleeps = []
+
+    monkeypatch.setattr(rate_limits, 'fetch', lambda url, timeout: responses.pop(0))
+    monkeypatch.setattr(rate_limits.time, 'sleep', sleeps.append)
+
+    response, attempts = fetch_politely('https://b.com/article')
+
+    assert response.status_code == 200
+    assert attempts == 3
+    assert sleeps[0] == 3
+    assert _get_host('https://b.com/article')['in_flight'] == 0
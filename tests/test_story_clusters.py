@@ -0,0 +1,59 @@
+import json
+import random
+
+from scipy import sparse
+
+from src.enums import Paths
+from src import story_clusters
+from src.story_clusters import assign_story_clusters
+
+
+def test_assign_story_clusters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    random_state = random.Random(0)
+    vocabulary = [f'lemma{i}' for i in range(10000)]
+
+    def document():
+        return {lemma: random_state.randint(1, 5) for lemma in random_state.sample(vocabulary, 100)}
+
+    documents = {str(i): document() for i in range(200)}
+    first_cluster_ids = assign_story_clusters(documents)
+    assert len(set(first_cluster_ids.values())) == 200
+    story_cluster_id = first_cluster_ids['7']
+
+    # The same story, told a bit differently, in this run and in a later one
+    same_story = dict(list(documents['7'].items())[10:], **{'lemma-new': 3})
+    cluster_ids = assign_story_clusters({'201': same_story, '202': document(), '203': dict(same_story)})
+
+    assert cluster_ids['201'] == cluster_ids['203'] == story_cluster_id
+    assert cluster_ids['202'] not in first_cluster_ids.values()
+    assert assign_story_clusters({'204': dict(same_story)}) == {'204': story_cluster_id}
+
+
+def test_assign_story_clusters_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cat, dog = {'cat': 3, 'purr': 2, 'whisker': 1}, {'dog': 3, 'bark': 2, 'leash': 1}
+
+    cluster_ids = assign_story_clusters({'1': cat, '2': dog})
+
+    # Article 2 analyzed again, now telling the story of article 1
+    assert assign_story_clusters({'2': dict(cat)}) == {'2': cluster_ids['1']}
+    assert assign_story_clusters({'3': dict(cat)}) == {'3': cluster_ids['1']}
+
+    clusters = json.loads((tmp_path / Paths.STORY_CLUSTERS.format(filename='clusters.json')).read_text())
+    assert clusters['filenames'] == ['1', '2', '3']
+    assert sparse.load_npz(tmp_path / Paths.STORY_CLUSTERS.format(filename='vectors.npz')).shape[0] == 3
+
+
+def test_assign_story_clusters_after_lsh_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cat, dog = {'cat': 3, 'purr': 2, 'whisker': 1}, {'dog': 3, 'bark': 2, 'leash': 1}
+    cluster_ids = assign_story_clusters({'1': cat, '2': dog})
+
+    # Same tables count, different bits: signatures must be computed again rather than compared as they are
+    monkeypatch.setattr(story_clusters, 'BITS_PER_TABLE', 12)
+    monkeypatch.setattr(story_clusters, '_projections', None)
+    assert assign_story_clusters({'3': dict(cat)}) == {'3': cluster_ids['1']}
+
+    clusters = json.loads((tmp_path / Paths.STORY_CLUSTERS.format(filename='clusters.json')).read_text())
+    assert clusters['lsh'] == [story_clusters.TABLES_COUNT, 12]
@@ -0,0 +1,35 @@
+from src.streams import stream
+
+
+def test_stream():
+    outputs = []
+
+    def fail_on_three(item):
+        if item == 3:
+            return None, ValueError()
+        return None, None
+
+    def collect(item):
+        outputs.append(item)
+        return None, None
+
+    stream(((0, i) for i in range(10)), [fail_on_three, collect], [3, 1], max_queue_size=2)
+
+    assert sorted(outputs) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+
+
+def test_stream_stage_raises():
+    outputs = []
+
+    def raise_on_three(item):
+        if item == 3:
+            raise ValueError()
+        return None, None
+
+    def collect(item):
+        outputs.append(item)
+        return None, None
+
+    stream(((0, i) for i in range(5)), [raise_on_three, collect], [1, 1], max_queue_size=1)
+
+    assert sorted(outputs) == [0, 1, 2, 4]